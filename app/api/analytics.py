@@ -4,25 +4,32 @@ from sklearn.linear_model import LinearRegression
 from sklearn.cluster import KMeans
 from datetime import timedelta
 
+from app.services.dedup import count_duplicate_rows
+from app.services.dtype_optimizer import widen_frame
+from app.services.profiler import profile_frame
+
 # --- 1. HEALTH MONITOR ---
-def calculate_data_health(df):
+def calculate_data_health(df, fingerprints=None):
     """
     Analyzes the quality of the uploaded CSV.
-    Returns a score (0-100) and a list of issues.
+    Returns a score (0-100), a list of issues and a per-column profile.
+    `fingerprints` are the frame's row fingerprints, if already built.
     """
+    df = widen_frame(df)
     issues = []
     score = 100
+    profile = profile_frame(df)
     
     # Check 1: Empty Cells
     total_cells = df.size
-    missing_cells = df.isnull().sum().sum()
+    missing_cells = profile.nulls
     if missing_cells > 0:
         missing_pct = (missing_cells / total_cells) * 100
         score -= min(30, int(missing_pct * 2)) # Penalty
         issues.append(f"{int(missing_pct)}% of data is empty/missing.")
 
     # Check 2: Duplicate Rows
-    duplicates = df.duplicated().sum()
+    duplicates = count_duplicate_rows(df, fingerprints)
     if duplicates > 0:
         score -= 10
         issues.append(f"Found {duplicates} duplicate rows.")
@@ -42,7 +49,8 @@ def calculate_data_health(df):
     return {
         "score": score,
         "status": status,
-        "issues": issues
+        "issues": issues,
+        "profile": profile.to_dict()
     }
 
 # --- 2. AI FORECASTER (Linear Regression) ---
@@ -52,7 +60,7 @@ def generate_forecast(df, date_col, value_col, periods=3):
     """
     try:
         # Prepare Data
-        df = df.copy()
+        df = widen_frame(df).copy()
         df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
         df = df.dropna(subset=[date_col, value_col])
         
@@ -96,6 +104,7 @@ def segment_customers(df, sales_col):
     """
     try:
         if len(df) < 5: return {"error": "Not enough data"}
+        df = widen_frame(df)
 
         # Reshape for K-Means
         X = df[[sales_col]].fillna(0).values
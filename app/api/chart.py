@@ -1,8 +1,11 @@
 
 # app/api/chart.py
-from fastapi import APIRouter, HTTPException
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from app.services.file_handler import get_dataframe
+from app.services.session import session_owner
 import pandas as pd
 
 router = APIRouter()
@@ -12,8 +15,9 @@ class ChartRequest(BaseModel):
     type: str # Hum type ko abhi bhi le rahe hain, lekin logic metric par depend karega
 
 @router.post("/chart")
-async def chart(req: ChartRequest):
-    df = get_dataframe()
+async def chart(req: ChartRequest, request: Request):
+    # May reload a spilled dataset from disk; keep that off the event loop
+    df = await asyncio.to_thread(get_dataframe, session_owner(request))
     if df is None:
         raise HTTPException(status_code=400, detail="No data available. Upload a file first.")
 
@@ -0,0 +1,160 @@
+# app/api/datasets.py
+import asyncio
+import os
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from app.services.dataset_store import DATASETS, get_dataset, DatasetNotFound
+from app.services.session import session_owner
+from app.services.arrow_transport import frame_response
+from app.services.cleaning import perform_cleaning
+from app.services.cleaning_plan import compile_plan, run_plan, PlanError
+from app.services.delta import frame_delta, wants_delta
+from app.services.dedup import cached_fingerprints
+from app.services.offload import run_cpu
+from app.services.versions import VERSIONS, VersionConflict, version_frame
+
+router = APIRouter()
+
+# Upper bound on rows per window so one request can't ask for the whole file
+MAX_PAGE_ROWS = int(os.environ.get("MORPH_MAX_PAGE_ROWS", "10000"))
+
+
+@router.get("/datasets/stats")
+async def dataset_stats():
+    """Resident and spilled bytes, budgets and spill/reload/eviction counts of the dataset registry."""
+    return dict(DATASETS.stats(), versions=VERSIONS.stats())
+
+
+@router.get("/datasets/{dataset_id}/rows")
+async def get_dataset_rows(
+    request: Request,
+    dataset_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1),
+    columns: str = Query(None),  # comma-separated column names to project
+    format: str = Query(None),  # "columnar" or row dicts (default)
+    version: str = Query(None),  # a version number or "head" (see /versions)
+):
+    """
+    Serves one window of a dataset registered by /api/process-file.
+    """
+    owner = session_owner(request)
+    try:
+        if version is not None:
+            df = await asyncio.to_thread(version_frame, owner, dataset_id, version)
+            all_columns = list(df.columns)
+        else:
+            all_columns = await asyncio.to_thread(DATASETS.columns, owner, dataset_id)
+        if columns:
+            wanted = [c.strip() for c in columns.split(",") if c.strip()]
+            missing = [c for c in wanted if c not in all_columns]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(missing)}")
+        else:
+            wanted = None
+        # A spilled dataset only pages in the projected columns
+        if version is None:
+            df = await asyncio.to_thread(get_dataset, dataset_id, owner, columns=wanted)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
+
+    limit = min(limit, MAX_PAGE_ROWS)
+    window = df.iloc[offset:offset + limit]
+    if wanted is not None:
+        window = window[wanted]
+
+    payload = {
+        "status": "success",
+        "dataset_id": dataset_id,
+        "row_count": len(df),
+        "column_count": len(all_columns),
+        "page": {"offset": offset, "limit": limit, "has_more": offset + limit < len(df)},
+    }
+    return frame_response(request, payload, window, format)
+
+
+@router.get("/datasets/{dataset_id}/versions")
+async def list_versions(request: Request, dataset_id: str):
+    """The dataset's versions, its head, and the memory they take versus separate copies."""
+    try:
+        history = await asyncio.to_thread(VERSIONS.history, session_owner(request), dataset_id)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
+    return await asyncio.to_thread(history.describe)
+
+
+@router.post("/datasets/{dataset_id}/versions")
+async def create_version(request: Request, dataset_id: str):
+    """
+    Cleans a version of the dataset (the head unless "from" is given) into a
+    new head. {"steps": [...]} runs a cleaning plan (see /api/clean-data/plan),
+    otherwise the standard clean runs. Unchanged columns stay shared with the
+    parent version. {"delta": true} returns the changes instead of the rows.
+    """
+    data = await request.json()
+    try:
+        history = await asyncio.to_thread(VERSIONS.history, session_owner(request), dataset_id)
+        parent = history.snapshot(data.get("from"))
+        df = await asyncio.to_thread(history.frame, parent.number)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset or version not found.")
+
+    meta = {"status": "success", "dataset_id": dataset_id}
+    try:
+        if data.get("steps") is not None:
+            plan = compile_plan(data["steps"], df.columns)
+            cleaned_df, report, sources = await run_cpu(
+                run_plan, df, plan, fingerprints=cached_fingerprints(df), with_sources=True)
+            meta.update(rows_removed=report["rows_before"] - report["rows_after"], report=report)
+            label = data.get("label") or ", ".join(step["op"] for step in report["steps"])
+        else:
+            cleaned_df, rows_removed, sources = await run_cpu(
+                perform_cleaning, df, fingerprints=cached_fingerprints(df), with_sources=True)
+            meta.update(rows_removed=rows_removed)
+            label = data.get("label") or "clean"
+    except PlanError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    except Exception as e:
+        print(f"Version Error: {e}")
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+    # Building on the head must not silently branch if another commit or revert landed meanwhile
+    expect_head = parent.number if data.get("from") is None else None
+    try:
+        snapshot = await asyncio.to_thread(history.commit, parent.number, cleaned_df, sources, label, expect_head)
+    except VersionConflict:
+        return JSONResponse(status_code=409, content={
+            "detail": "The dataset's head changed while this version was being made. Please retry."})
+    await asyncio.to_thread(VERSIONS.relieve, history)
+    meta.update(version=snapshot.number, parent=parent.number)
+    if wants_delta(data):
+        changes = await asyncio.to_thread(frame_delta, df, cleaned_df, *sources)
+        if changes is not None:
+            return JSONResponse(dict(meta, **changes))
+    return frame_response(request, meta, cleaned_df, nan='""')
+
+
+@router.post("/datasets/{dataset_id}/versions/{version}/revert")
+async def revert_version(request: Request, dataset_id: str, version: int):
+    """Makes `version` the head again; later versions are kept, so this can be redone."""
+    try:
+        history = await asyncio.to_thread(VERSIONS.history, session_owner(request), dataset_id, create=False)
+        snapshot = await asyncio.to_thread(history.revert, version)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset or version not found.")
+    return {"status": "success", "dataset_id": dataset_id, "head": snapshot.number, "rows": len(snapshot)}
+
+
+@router.get("/datasets/{dataset_id}/versions/diff")
+async def diff_versions(
+    request: Request,
+    dataset_id: str,
+    from_version: str = Query("0", alias="from"),
+    to_version: str = Query("head", alias="to"),
+):
+    """Rows, columns and cells that differ between two versions (see VersionHistory.diff)."""
+    try:
+        history = await asyncio.to_thread(VERSIONS.history, session_owner(request), dataset_id, create=False)
+        return await asyncio.to_thread(history.diff, from_version, to_version)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset or version not found.")
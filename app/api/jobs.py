@@ -0,0 +1,302 @@
+# app/api/jobs.py
+import asyncio
+import os
+import shutil
+
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
+
+from app.api.analytics import generate_forecast
+from app.services.arrow_transport import frame_response, read_frame_request
+from app.services.cleaning import perform_cleaning
+from app.services.dataset_store import DATASETS, DatasetNotFound, DatasetTooLarge, register_dataset
+from app.services.exporter import EXPORT_MEDIA_TYPES, write_export
+from app.services.ingest import (
+    ARROW_EXTENSIONS, NDJSON_EXTENSIONS, PARQUET_EXTENSIONS,
+    IngestError, list_excel_sheets, parse_columns_option, parse_upload, spooled_upload,
+)
+from app.services.jobs import JOB_RUNNER, JOBS, JobError, JobNotFound, in_store_thread, job_handler
+from app.services.offload import FrameRef, load_frame, run_cpu, save_frame
+from app.services.parse_cache import PARSE_CACHE, cache_key, frame_nbytes
+from app.services.session import session_owner
+
+router = APIRouter()
+
+# Staged input and result frames inside each job's directory
+INPUT_FRAME = "input.frame"
+RESULT_FRAME = "result.frame"
+
+
+def _frame_key(params: dict) -> tuple:
+    columns = tuple(params["columns"] or ())
+    if params["cache_kind"] == "excel":
+        return cache_key(params["digest"], "excel", sheet=params["sheet"], columns=columns)
+    return cache_key(params["digest"], params["cache_kind"], columns=columns)
+
+
+def _submitted(job_id: str, kind: str) -> JSONResponse:
+    JOB_RUNNER.wake()
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "job_id": job_id,
+        "kind": kind,
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result",
+    })
+
+
+async def _submit_frame_job(request: Request, kind: str, params: dict) -> JSONResponse:
+    """Stages the request's dataset in a new job directory and queues the job."""
+    try:
+        data, df = await read_frame_request(request)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
+    job_id = await in_store_thread(JOBS.new_job)
+    try:
+        await asyncio.to_thread(save_frame, df, os.path.join(JOBS.job_dir(job_id), INPUT_FRAME))
+        options = {key: data.get(key, default) for key, default in params.items()}
+        await in_store_thread(JOBS.submit, job_id, kind, session_owner(request), options)
+    except BaseException:
+        shutil.rmtree(JOBS.job_dir(job_id), ignore_errors=True)
+        raise
+    return _submitted(job_id, kind)
+
+
+# --- Submit ---
+
+@router.post("/jobs/process-file")
+async def submit_process_file(
+    request: Request,
+    file: UploadFile = File(...),
+    sheet: str = Form(None),
+    format: str = Form(None),
+    page_size: int = Form(None),
+    columns: str = Form(None),
+):
+    """
+    Queues /api/process-file as a job. The upload is stored with the job so
+    it can be parsed after a restart; multi-sheet workbooks without a sheet
+    answer straight away, as the synchronous endpoint does.
+    """
+    if page_size is not None and page_size < 1:
+        return JSONResponse(status_code=400, content={"detail": "page_size must be a positive number."})
+    filename = file.filename.lower()
+    if not filename.endswith(('.xlsx', '.xls', '.csv') + PARQUET_EXTENSIONS + ARROW_EXTENSIONS + NDJSON_EXTENSIONS):
+        return JSONResponse(status_code=400, content={"detail": "Invalid file type. Please upload CSV, Excel, Parquet, Arrow/Feather or NDJSON."})
+    # Unknown columns are reported by the job, once the file is read
+    projection = parse_columns_option(columns)
+
+    job_id = await in_store_thread(JOBS.new_job)
+    try:
+        async with spooled_upload(file) as upload:
+            target_sheet = None
+            if file.filename.endswith(('.xlsx', '.xls')):
+                sheet_names = await asyncio.to_thread(list_excel_sheets, upload.path, file.filename)
+                if len(sheet_names) > 1 and not sheet:
+                    shutil.rmtree(JOBS.job_dir(job_id), ignore_errors=True)
+                    return {"status": "multi_sheet", "sheets": sheet_names, "message": "Multiple sheets found."}
+                target_sheet = sheet if sheet else sheet_names[0]
+                cache_kind = "excel"
+            elif filename.endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS + NDJSON_EXTENSIONS):
+                cache_kind = "table"
+            else:
+                cache_kind = "csv"
+            # The spool file is moved into the job directory instead of being deleted
+            input_name = "input" + os.path.splitext(filename)[1]
+            await asyncio.to_thread(shutil.move, upload.path, os.path.join(JOBS.job_dir(job_id), input_name))
+            params = {
+                "filename": file.filename, "input": input_name, "size": upload.size, "digest": upload.digest,
+                "cache_kind": cache_kind, "sheet": target_sheet, "columns": projection,
+                "format": format, "page_size": page_size,
+            }
+        await in_store_thread(JOBS.submit, job_id, "process-file", session_owner(request), params)
+    except BaseException:
+        shutil.rmtree(JOBS.job_dir(job_id), ignore_errors=True)
+        raise
+    return _submitted(job_id, "process-file")
+
+
+@router.post("/jobs/clean-data")
+async def submit_clean_data(request: Request):
+    """Queues /api/clean-data for a dataset_id, inline rows or an Arrow body."""
+    return await _submit_frame_job(request, "clean-data", {})
+
+
+@router.post("/jobs/analyze/forecast")
+async def submit_forecast(request: Request):
+    """Queues /api/analyze/forecast; takes the same date_col/value_col options."""
+    return await _submit_frame_job(request, "forecast", {"date_col": None, "value_col": None})
+
+
+@router.post("/jobs/export-data")
+async def submit_export(request: Request):
+    """Queues /api/export-data; format is 'csv' (default), 'xlsx' or 'arrow'."""
+    return await _submit_frame_job(request, "export-data", {"format": None})
+
+
+# --- Status and results ---
+
+@router.get("/jobs/stats")
+async def job_stats():
+    """Job counts by state."""
+    return await in_store_thread(JOBS.counts)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(request: Request, job_id: str):
+    """Current stage and progress counters (bytes_read, rows_parsed, ...) of a job."""
+    try:
+        job = await in_store_thread(JOBS.get, job_id, session_owner(request))
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    status = {
+        "job_id": job_id,
+        "kind": job["kind"],
+        "state": job["state"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["state"] == "failed":
+        status["error"] = job["error"]
+    if job["state"] == "done":
+        status["result_url"] = f"/api/jobs/{job_id}/result"
+    return status
+
+
+def _result_dataset(job: dict, owner: str):
+    """Registers a finished job's frame once per process; returns (dataset_id, df)."""
+    dataset_id = JOBS.result_datasets.get(job["id"])
+    if dataset_id is not None:
+        try:
+            return dataset_id, DATASETS.get(owner, dataset_id)
+        except DatasetNotFound:
+            pass
+    df = load_frame(FrameRef(os.path.join(JOBS.job_dir(job["id"]), RESULT_FRAME)))
+    dataset_id = register_dataset(df, owner)
+    JOBS.result_datasets[job["id"]] = dataset_id
+    return dataset_id, df
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(request: Request, job_id: str):
+    """
+    The job's output, in the same shape as the synchronous endpoint
+    (Arrow IPC when requested). 409 while the job hasn't finished.
+    """
+    owner = session_owner(request)
+    try:
+        job = await in_store_thread(JOBS.get, job_id, owner)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["state"] == "failed":
+        return JSONResponse(status_code=job["error_status"] or 500, content={"detail": job["error"]})
+    if job["state"] != "done":
+        return JSONResponse(status_code=409, content={
+            "detail": "Job has not finished yet.", "state": job["state"], "stage": job["stage"],
+        })
+
+    params, result = job["params"], job["result"]
+    if job["kind"] == "forecast":
+        return result
+    if job["kind"] == "export-data":
+        filename = "Cleaned_Data." + result["format"]
+        return FileResponse(
+            os.path.join(JOBS.job_dir(job_id), filename),
+            media_type=EXPORT_MEDIA_TYPES[result["format"]],
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+
+    try:
+        dataset_id, df = await asyncio.to_thread(_result_dataset, job, owner)
+    except DatasetTooLarge as e:
+        return JSONResponse(status_code=413, content={"detail": str(e)})
+
+    if job["kind"] == "clean-data":
+        return frame_response(request, {
+            "status": "success",
+            "dataset_id": dataset_id,
+            "rows_removed": result["rows_removed"],
+            "job_id": job_id,
+        }, df, nan='""')
+
+    page_size = params["page_size"]
+    payload = {
+        "status": "success",
+        "dataset_id": dataset_id,
+        "row_count": result["row_count"],
+        "column_count": result["column_count"],
+        "encoding": result["encoding"],
+        "memory": result["memory"],
+        "job_id": job_id,
+    }
+    if page_size:
+        df = df.iloc[:page_size]
+        payload["page"] = {"offset": 0, "limit": page_size, "has_more": result["row_count"] > page_size}
+    return frame_response(request, payload, df, params["format"])
+
+
+# --- Job handlers (run by the JobRunner) ---
+
+@job_handler("process-file")
+async def run_process_file(job: dict, progress) -> dict:
+    params = job["params"]
+    frame_key = _frame_key(params)
+    progress(stage="parsing", bytes_total=params["size"])
+    cached = PARSE_CACHE.get(frame_key)
+    if cached is not None:
+        df, encoding, memory = cached["df"], cached["encoding"], cached["memory"]
+    else:
+        try:
+            df, encoding, memory = await run_cpu(
+                parse_upload, os.path.join(JOBS.job_dir(job["id"]), params["input"]), params["filename"],
+                sheet=params["sheet"], columns=params["columns"], progress=progress, size_hint=params["size"],
+            )
+        except IngestError as e:
+            raise JobError(str(e), 400)
+        PARSE_CACHE.put(frame_key, {"df": df, "encoding": encoding, "memory": memory}, frame_nbytes(df))
+
+    progress(stage="saving", rows_parsed=len(df), bytes_read=params["size"])
+    await asyncio.to_thread(save_frame, df, os.path.join(JOBS.job_dir(job["id"]), RESULT_FRAME))
+    return {
+        "row_count": len(df),
+        "column_count": df.shape[1],
+        "encoding": encoding['encoding'] if encoding else None,
+        "memory": memory,
+    }
+
+
+@job_handler("clean-data")
+async def run_clean_data(job: dict, progress) -> dict:
+    job_dir = JOBS.job_dir(job["id"])
+    progress(stage="cleaning")
+    cleaned_df, rows_removed = await run_cpu(perform_cleaning, FrameRef(os.path.join(job_dir, INPUT_FRAME)))
+    progress(stage="saving", rows=len(cleaned_df))
+    await asyncio.to_thread(save_frame, cleaned_df, os.path.join(job_dir, RESULT_FRAME))
+    return {"rows_removed": rows_removed}
+
+
+@job_handler("forecast")
+async def run_forecast(job: dict, progress) -> dict:
+    params = job["params"]
+    progress(stage="forecasting")
+    result = await run_cpu(
+        generate_forecast, FrameRef(os.path.join(JOBS.job_dir(job["id"]), INPUT_FRAME)),
+        params["date_col"], params["value_col"],
+    )
+    return jsonable_encoder(result)
+
+
+@job_handler("export-data")
+async def run_export(job: dict, progress) -> dict:
+    job_dir = JOBS.job_dir(job["id"])
+    file_format = job["params"]["format"] if job["params"]["format"] in EXPORT_MEDIA_TYPES else "csv"
+    progress(stage="writing")
+    written = await run_cpu(
+        write_export, FrameRef(os.path.join(job_dir, INPUT_FRAME)), file_format,
+        os.path.join(job_dir, f"Cleaned_Data.{file_format}"),
+    )
+    return {"format": written}
@@ -1,14 +1,16 @@
 import os
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, Request, UploadFile, File
 from fastapi.responses import JSONResponse
 from app.services.file_handler import save_file
+from app.services.session import session_owner
+from app.services.dataset_store import DatasetTooLarge
 
 router = APIRouter()
 UPLOAD_DIR = "uploads_files"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request, file: UploadFile = File(...)):
     """
     Upload a CSV/Excel file and load into DataFrame.
     """
@@ -18,7 +20,10 @@ async def upload_file(file: UploadFile = File(...)):
             status_code=400,
         )
 
-    result = await save_file(file)
+    try:
+        result = await save_file(file, session_owner(request))
+    except DatasetTooLarge as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=413)
 
     if not result["success"]:
         return JSONResponse(
@@ -30,5 +35,7 @@ async def upload_file(file: UploadFile = File(...)):
         "status": "success",
         "filename": result["filename"],
         "size": result["size"],
+        "dataset_id": result["dataset_id"],
+        "memory": result.get("memory"),
         "message": "File uploaded and dataframe loaded ✅"
     }
@@ -11,9 +11,12 @@ from fastapi import Depends
 from fastapi.responses import RedirectResponse
 from app.api.auth import get_current_user # This imports your security guard
 import time
+import asyncio
 from fastapi.responses import StreamingResponse
 from supabase import create_client, Client
 from app.api import upload, chart, auth  # <-- This line now works because auth.py exists
+from app.api import datasets, jobs
+from app.services.jobs import JOB_RUNNER
 from app.services.file_handler import get_dataframe
 import razorpay
 from fastapi import FastAPI, HTTPException
@@ -22,6 +25,24 @@ from razorpay.errors import SignatureVerificationError
 import os
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
 from app.services.file_handler import process_uploaded_file # <-- Import the new function
+from app.services.parse_cache import PARSE_CACHE, cache_key, frame_nbytes
+from app.services.dataset_store import register_dataset, DatasetNotFound, DatasetTooLarge
+from app.services.session import SessionMiddleware, session_owner
+from app.services.admission import AdmissionMiddleware, ADMISSION
+from app.services.compression import CompressionMiddleware, COMPRESSION_STATS
+from app.services.arrow_transport import wants_arrow, arrow_response, frame_response, read_frame_request
+from app.services.ingest import spooled_upload, list_excel_sheets, parse_upload
+from app.services.ingest import IngestError, PARQUET_EXTENSIONS, ARROW_EXTENSIONS, NDJSON_EXTENSIONS, parse_columns_option
+from app.services.offload import run_cpu
+from app.services.cleaning import perform_cleaning
+from app.services.cleaning_plan import compile_plan, run_plan, PlanError
+from app.services.delta import frame_delta, wants_delta
+from app.services.dedup import cached_fingerprints, count_duplicate_rows, duplicate_index
+from app.services.exporter import write_export, EXPORT_MEDIA_TYPES
+import tempfile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+import io
 from io import BytesIO
 # from supabase import create_client, Client
 class PaymentVerification(BaseModel):
@@ -48,6 +69,9 @@ app = FastAPI(title="Morph-AI Backend")
 # Configure Jinja2 to find HTML templates in the "templates" directory
 templates = Jinja2Templates(directory="templates")
 
+# Concurrency and body-size limits for the heavy endpoints (added first so CORS headers wrap its rejections)
+app.add_middleware(AdmissionMiddleware)
+
 # Add CORS Middleware to allow the frontend to communicate with this backend
 app.add_middleware(
     CORSMiddleware,
@@ -57,6 +81,12 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Compress large responses (gzip/brotli/zstd, negotiated from Accept-Encoding)
+app.add_middleware(CompressionMiddleware)
+
+# Session cookie that scopes server-held datasets to the client that uploaded them
+app.add_middleware(SessionMiddleware)
+
 #  3. API ROUTERS
 
 # Include routers from other files (upload.py, chart.py)
@@ -68,13 +98,27 @@ app.include_router(auth.router) # <-- CORRECTED: The "/api" prefix is removed
 
 
 app.include_router(credits.router, prefix="/api") # <-- ADD THIS LINE
+app.include_router(datasets.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+
+
+@app.on_event("startup")
+async def start_job_runner():
+    # Also resumes jobs left queued or running by a previous process
+    await JOB_RUNNER.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    await JOB_RUNNER.stop()
+
 #  4. CORE API ENDPOINTS
 @app.get("/api/summary")
-def get_summary():
+def get_summary(request: Request):
     """
     Calculates summary statistics and identifies column types from the uploaded data.
     """
-    df = get_dataframe()
+    df = get_dataframe(session_owner(request))
     if df is None or df.empty:
         return JSONResponse(content={"error": "No data available to summarize."}, status_code=404)
 
@@ -82,7 +126,7 @@ def get_summary():
         numeric_columns = df.select_dtypes(include='number').columns.tolist()
         
         categorical_columns = []
-        for col in df.select_dtypes(include=['object', 'category']).columns:
+        for col in df.select_dtypes(include=['object', 'category', 'string']).columns:
             if df[col].nunique() < 50:
                 categorical_columns.append(col)
         total_sales = float(pd.to_numeric(df["Sales"], errors='coerce').sum()) if "Sales" in df.columns else 0
@@ -368,21 +412,37 @@ from app.api.analytics import calculate_data_health, generate_forecast, segment_
 # --- 1. Health Check Endpoint ---
 @app.post("/api/analyze/health")
 async def analyze_health(request: Request):
-    data = await request.json()
-    # Convert JSON back to DataFrame
-    df = pd.DataFrame(data['rows']) 
-    result = calculate_data_health(df)
+    # Use the server-held dataset, or convert posted JSON/Arrow back to a DataFrame
+    try:
+        data, df = await read_frame_request(request)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
+    # Fingerprint here so the duplicate mask stays cached with the dataset across requests
+    fingerprints = await asyncio.to_thread(duplicate_index, df)
+    result = await run_cpu(calculate_data_health, df, fingerprints=fingerprints)
     return result
 
+@app.post("/api/analyze/duplicates")
+async def analyze_duplicates(request: Request):
+    """Duplicate-row count for a dataset (same as pandas' duplicated().sum())."""
+    try:
+        data, df = await read_frame_request(request)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
+    duplicates = await asyncio.to_thread(count_duplicate_rows, df)
+    return {"rows": len(df), "duplicates": duplicates}
+
 # --- 2. Forecast Endpoint ---
 @app.post("/api/analyze/forecast")
 async def get_forecast(request: Request):
-    data = await request.json()
-    df = pd.DataFrame(data['rows'])
+    try:
+        data, df = await read_frame_request(request)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail="Dataset not found. Please upload the file again.")
     date_col = data.get('date_col')
     value_col = data.get('value_col')
     
-    return generate_forecast(df, date_col, value_col)
+    return await run_cpu(generate_forecast, df, date_col, value_col)
 
 # For reset or fogot password
 # Pass the keys to the template
@@ -399,87 +459,123 @@ async def get_forgot_password(request: Request):
 async def get_reset_password(request: Request):
     return templates.TemplateResponse("reset_password.html", {"request": request})
 
+@app.get("/api/compression/stats")
+async def get_compression_stats():
+    """Per-route compression ratio and CPU time."""
+    return COMPRESSION_STATS.snapshot()
+
+@app.get("/api/parse-cache/stats")
+async def get_parse_cache_stats():
+    """Hit, miss and eviction counters for the upload parse cache."""
+    return PARSE_CACHE.stats()
+
+@app.get("/api/admission/stats")
+async def get_admission_stats():
+    """Active requests, queue depth and rejection counts per endpoint class."""
+    return ADMISSION.stats()
+
 @app.post("/api/process-file")
 async def process_file(
+    request: Request,
     file: UploadFile = File(...), 
-    sheet: str = Form(None)  # New optional parameter
+    sheet: str = Form(None),  # New optional parameter
+    format: str = Form(None),  # "columnar" for one array per column instead of row dicts
+    page_size: int = Form(None),  # Only return the first page_size rows
+    columns: str = Form(None)  # Comma-separated columns to load (projection)
 ):
     try:
-        contents = await file.read()
-        file_bytes = BytesIO(contents)
-        df = None
-        
-        # 1. Handle Excel Files
-        if file.filename.endswith(('.xlsx', '.xls')):
-            # Load the Excel file wrapper to check sheet names first
-            xls = pd.ExcelFile(file_bytes)
-            sheet_names = xls.sheet_names
-            
-            # CASE A: Multiple Sheets found & User hasn't chosen one yet
-            if len(sheet_names) > 1 and not sheet:
-                return {
-                    "status": "multi_sheet", 
-                    "sheets": sheet_names,
-                    "message": "Multiple sheets found."
-                }
-            
-            # CASE B: User selected a sheet OR there is only one sheet
-            target_sheet = sheet if sheet else 0
-            df = pd.read_excel(file_bytes, sheet_name=target_sheet)
-
-        # 2. Handle CSV Files
-        elif file.filename.endswith('.csv'):
-            # Try different encodings to avoid errors
-            try:
-                # Read without header to look at raw data
-                df_temp = pd.read_csv(file_bytes, header=None, encoding='utf-8')
-            except UnicodeDecodeError:
-                file_bytes.seek(0)
-                df_temp = pd.read_csv(file_bytes, header=None, encoding='ISO-8859-1')
-            max_non_nulls = 0
-            header_row_index = 0
-            
-            for i in range(min(50, len(df_temp))):
-                non_null_count = df_temp.iloc[i].count()
-                if non_null_count > max_non_nulls:
-                    max_non_nulls = non_null_count
-                    header_row_index = i
-            
-            # 2. Reload the CSV using the detected header
-            file_bytes.seek(0) # Reset pointer
-            try:
-                df = pd.read_csv(file_bytes, header=header_row_index, encoding='utf-8')
-            except UnicodeDecodeError:
-                file_bytes.seek(0)
-                df = pd.read_csv(file_bytes, header=header_row_index, encoding='ISO-8859-1')
-
-        else:
-            return JSONResponse(status_code=400, content={"detail": "Invalid file type. Please upload CSV or Excel."})
+        if page_size is not None and page_size < 1:
+            return JSONResponse(status_code=400, content={"detail": "page_size must be a positive number."})
+        if not file.filename.lower().endswith(('.xlsx', '.xls', '.csv') + PARQUET_EXTENSIONS + ARROW_EXTENSIONS + NDJSON_EXTENSIONS):
+            return JSONResponse(status_code=400, content={"detail": "Invalid file type. Please upload CSV, Excel, Parquet, Arrow/Feather or NDJSON."})
+        projection = parse_columns_option(columns)
+        filename = file.filename.lower()
 
-       
+        df = None
+        encoding = None
+        memory = None
+        # Spool the upload to disk in chunks instead of holding it all in memory
+        async with spooled_upload(file) as upload:
+
+            # 1. Handle Excel Files
+            if file.filename.endswith(('.xlsx', '.xls')):
+                # Sheet names and parsed sheets are cached by content hash, so the
+                # multi-sheet round trip (same bytes + sheet=...) skips re-parsing
+                sheets_key = cache_key(upload.digest, "sheets")
+                sheet_names = PARSE_CACHE.get(sheets_key)
+                if sheet_names is None:
+                    # Sheet names come from workbook metadata, no cell data is loaded
+                    sheet_names = await asyncio.to_thread(list_excel_sheets, upload.path, file.filename)
+                    PARSE_CACHE.put(sheets_key, sheet_names, sum(len(n) for n in sheet_names) + 64)
+
+                # CASE A: Multiple Sheets found & User hasn't chosen one yet
+                if len(sheet_names) > 1 and not sheet:
+                    return {
+                        "status": "multi_sheet",
+                        "sheets": sheet_names,
+                        "message": "Multiple sheets found."
+                    }
+
+                # CASE B: User selected a sheet OR there is only one sheet
+                target_sheet = sheet if sheet else sheet_names[0]
+                frame_key = cache_key(upload.digest, "excel", sheet=target_sheet, columns=tuple(projection or ()))
+
+            # 2. Columnar and line-delimited formats, read with column projection
+            elif filename.endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS + NDJSON_EXTENSIONS):
+                target_sheet = None
+                frame_key = cache_key(upload.digest, "table", columns=tuple(projection or ()))
+
+            # 3. Handle CSV Files
+            else:
+                # Dialect, header row and codec are all derived from the bytes, so the digest is enough
+                target_sheet = None
+                frame_key = cache_key(upload.digest, "csv", columns=tuple(projection or ()))
+
+            cached = PARSE_CACHE.get(frame_key)
+            if cached is not None:
+                df, encoding, memory = cached["df"], cached["encoding"], cached["memory"]
+            else:
+                # Parse and shrink dtypes in a worker process so the event loop keeps serving;
+                # the cache and the dataset store hold the compact frame
+                df, encoding, memory = await run_cpu(
+                    parse_upload, upload.path, file.filename,
+                    sheet=target_sheet, columns=projection, size_hint=upload.size,
+                )
+                PARSE_CACHE.put(frame_key, {"df": df, "encoding": encoding, "memory": memory}, frame_nbytes(df))
 
         if df is None:
             return JSONResponse(status_code=400, content={"detail": "Invalid file."})
 
-        # --- 3. JSON SAFETY BLOCK (THE FIX) ---
-        # This prevents the "500 Internal Server Error"
-        
-        # A. Remove columns that are 100% empty (Safe cleanup)
-        df = df.dropna(axis=1, how='all')
-
-        # B. Replace Infinity with 0
-        df = df.replace([np.inf, -np.inf], 0)
-
-        # C. Replace NaN with None (This is what JSON needs)
-        # We assume Object type to allow None values in numeric columns
-        df = df.astype(object)
-        df = df.where(pd.notnull(df), None)
-
-        return {
+        # --- 3. CLEANUP ---
+        # Columns that are 100% empty were already dropped by parse_upload.
+        # Keep the parsed frame server-side so follow-up calls can send its ID instead of rows
+        # (registering may publish it to the shared store or spill others to disk)
+        dataset_id = await asyncio.to_thread(register_dataset, df, session_owner(request))
+
+        # Only the first page goes back when page_size is set; the rest is served by
+        # /api/datasets/{dataset_id}/rows from the server-held frame
+        row_count = len(df)
+        if page_size:
+            df = df.iloc[:page_size]
+        payload = {
             "status": "success",
-            "headers": df.columns.tolist(),
-            "data": df.to_dict(orient='records')
+            "dataset_id": dataset_id,
+            "row_count": row_count,
+            "column_count": df.shape[1],
+            "encoding": encoding['encoding'] if encoding else None,
+            "memory": memory,
         }
+        if page_size:
+            payload["page"] = {"offset": 0, "limit": page_size, "has_more": row_count > page_size}
+
+        # Arrow IPC clients get the frame buffers directly, no per-cell JSON encoding.
+        # B. JSON SAFETY: the encoder writes NaN as null (and Infinity as 0 in row
+        # objects) straight from the column buffers, so the frame is never copied
+        return frame_response(request, payload, df, format)
+    except IngestError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    except DatasetTooLarge as e:
+        return JSONResponse(status_code=413, content={"detail": str(e)})
     except Exception as e:
         print(f"Upload Error: {e}")
         return JSONResponse(status_code=500, content={"detail": str(e)})
@@ -487,122 +583,111 @@ async def process_file(
 
 
 
-def perform_cleaning(df):
-    """
-    Smart Cleaning with Correct "Rows Removed" Count.
-    1. Finds & Promotes Header (Does not count this as 'removed').
-    2. Deletes ONLY true junk rows.
-    """
-    initial_rows = len(df)
-    header_fixed = False # Flag to track if we moved a header
-
-    # --- 1. SMART HEADER DETECTION ---
-    first_col = str(df.columns[0])
-    if first_col.startswith('Unnamed') or "Sample" in first_col or "Data" in first_col:
-        
-        best_row_index = -1
-        max_score = 0
-        keywords = ['id', 'name', 'date', 'price', 'cost', 'stock', 'sku', 'total', 'sales', 'profit', 'category']
-        
-        for i in range(min(20, len(df))):
-            row = df.iloc[i]
-            row_str = str(row.tolist()).lower()
-            text_count = sum(1 for val in row if isinstance(val, str) and len(str(val).strip()) > 0)
-            keyword_bonus = sum(5 for k in keywords if k in row_str)
-            
-            if (text_count + keyword_bonus) > max_score:
-                max_score = text_count + keyword_bonus
-                best_row_index = i
-        
-        # Promote the winner row to Header
-        if best_row_index != -1 and max_score > 2:
-            new_header = df.iloc[best_row_index]
-            df = df.iloc[best_row_index + 1:] 
-            
-            cleaned_columns = []
-            for i, val in enumerate(new_header):
-                if pd.isna(val) or str(val).strip() == "":
-                    cleaned_columns.append(f"Column_{i+1}")
-                else:
-                    cleaned_columns.append(str(val).strip())
-            df.columns = cleaned_columns
-            df = df.reset_index(drop=True)
-            header_fixed = True # We moved a row to header!
-
-    # --- 2. SAFE CLEANING ---
-    # Remove "Unnamed" columns only if safe
-    valid_cols = [c for c in df.columns if not str(c).startswith('Unnamed') and not str(c).startswith('Column_')]
-    if len(valid_cols) > 0:
-        df = df[valid_cols]
-
-    # Drop Duplicates & Empty Rows
-    df = df.drop_duplicates()
-    df = df.dropna(how='all') 
-    
-    # JSON Safety
-    df = df.fillna("") 
-    df = df.replace([np.inf, -np.inf], 0)
-
-    # --- 3. CALCULATE "TRUE" REMOVED ROWS ---
-    final_rows = len(df)
-    rows_removed = initial_rows - final_rows
-    
-    # FIX: If we promoted a header, don't count it as "Removed data"
-    if header_fixed:
-        rows_removed -= 1
-        
-    # Ensure we never show negative numbers
-    rows_removed = max(0, rows_removed)
-    
-    return df, rows_removed
 @app.post("/api/clean-data")
 async def clean_data_endpoint(request: Request):
     try:
-        data = await request.json()
-        df = pd.DataFrame(data['rows'])
-        
-        cleaned_df, rows_removed = perform_cleaning(df)
-        
-        return {
+        try:
+            data, df = await read_frame_request(request)
+        except DatasetNotFound:
+            return JSONResponse(status_code=404, content={"detail": "Dataset not found. Please upload the file again."})
+
+        # {"delta": true} asks for only what changed, to patch the client's copy of the rows
+        delta = wants_delta(data)
+        cleaned_df, rows_removed, *sources = await run_cpu(
+            perform_cleaning, df, fingerprints=cached_fingerprints(df), with_sources=delta)
+        try:
+            dataset_id = await asyncio.to_thread(register_dataset, cleaned_df, session_owner(request))
+        except DatasetTooLarge as e:
+            return JSONResponse(status_code=413, content={"detail": str(e)})
+
+        meta = {
             "status": "success",
+            "dataset_id": dataset_id,
             "rows_removed": rows_removed,
-            "headers": cleaned_df.columns.tolist(), # <--- ADD THIS LINE !!!
-            "data": cleaned_df.to_dict(orient='records')
         }
+        if delta:
+            changes = await asyncio.to_thread(frame_delta, df, cleaned_df, *sources[0])
+            if changes is not None:
+                return JSONResponse(dict(meta, **changes))
+        # Row objects also carry the headers list; empty cells go out as ""
+        return frame_response(request, meta, cleaned_df, nan='""')
     except Exception as e:
         print(f"Clean Error: {e}")
         return JSONResponse(status_code=500, content={"detail": str(e)})
     
+@app.post("/api/clean-data/plan")
+async def clean_plan_endpoint(request: Request):
+    """
+    Runs the client's own cleaning steps, e.g.
+    {"dataset_id": ..., "steps": [{"op": "trim"}, {"op": "dedup", "columns": ["Order ID"]},
+    {"op": "fill", "values": {"Region": "Unknown"}}, {"op": "coerce", "types": {"Price": "number"}},
+    {"op": "drop_empty"}]}, and reports each step's time and rows affected.
+    Accepts {"delta": true} like /api/clean-data.
+    """
+    try:
+        try:
+            data, df = await read_frame_request(request)
+        except DatasetNotFound:
+            return JSONResponse(status_code=404, content={"detail": "Dataset not found. Please upload the file again."})
+        try:
+            plan = compile_plan(data.get("steps"), df.columns)
+        except PlanError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+
+        delta = wants_delta(data)
+        cleaned_df, report, *sources = await run_cpu(
+            run_plan, df, plan, fingerprints=cached_fingerprints(df), with_sources=delta)
+        try:
+            dataset_id = await asyncio.to_thread(register_dataset, cleaned_df, session_owner(request))
+        except DatasetTooLarge as e:
+            return JSONResponse(status_code=413, content={"detail": str(e)})
+
+        meta = {
+            "status": "success",
+            "dataset_id": dataset_id,
+            "rows_removed": report["rows_before"] - report["rows_after"],
+            "report": report,
+        }
+        if delta:
+            changes = await asyncio.to_thread(frame_delta, df, cleaned_df, *sources[0])
+            if changes is not None:
+                return JSONResponse(dict(meta, **changes))
+        return frame_response(request, meta, cleaned_df, nan='""')
+    except Exception as e:
+        print(f"Clean Plan Error: {e}")
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
 @app.post("/api/export-data")
 async def export_data_endpoint(request: Request):
     try:
-        body = await request.json()
-        rows = body.get('rows', [])
-        file_format = body.get('format', 'csv') # 'csv' or 'xlsx'
-        
-        df = pd.DataFrame(rows)
-        
-        # --- EXPORT AS EXCEL ---
-        if file_format == 'xlsx':
-            output = io.BytesIO()
-            # Use ExcelWriter to create a real Excel file
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Cleaned Data')
-            
-            output.seek(0)
-            return StreamingResponse(
-                output, 
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment; filename=Cleaned_Data.xlsx"}
-            )
-            
-        # --- EXPORT AS CSV (Default) ---
-        else:
-            stream = io.StringIO()
-            df.to_csv(stream, index=False)
-            response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
-            response.headers["Content-Disposition"] = "attachment; filename=Cleaned_Data.csv"
+        try:
+            body, df = await read_frame_request(request)
+        except DatasetNotFound:
+            return JSONResponse(status_code=404, content={"detail": "Dataset not found. Please upload the file again."})
+        file_format = body.get('format', 'csv') # 'csv', 'xlsx' or 'arrow'
+
+        # --- EXPORT AS ARROW IPC STREAM ---
+        if file_format == 'arrow' or (wants_arrow(request) and 'format' not in body):
+            response = arrow_response(df)
+            response.headers["Content-Disposition"] = "attachment; filename=Cleaned_Data.arrow"
             return response
 
+        # --- EXPORT AS EXCEL OR CSV (Default) ---
+        # The file is written by a worker process, then sent from disk and deleted
+        fd, path = tempfile.mkstemp(prefix="morph_export_")
+        os.close(fd)
+        try:
+            written = await run_cpu(write_export, df, file_format, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        filename = "Cleaned_Data.xlsx" if written == "xlsx" else "Cleaned_Data.csv"
+        return FileResponse(
+            path,
+            media_type=EXPORT_MEDIA_TYPES[written],
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+            background=BackgroundTask(os.remove, path),
+        )
+
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
\ No newline at end of file
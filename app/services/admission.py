@@ -0,0 +1,266 @@
+import asyncio
+import math
+import os
+import re
+import time
+
+from fastapi.responses import JSONResponse
+from starlette.requests import cookie_parser
+
+from app.services.session import SESSION_COOKIE
+
+_CPUS = os.cpu_count() or 1
+
+# Concurrent requests per endpoint class, and how many more may wait for a slot.
+INGEST_CONCURRENCY = int(os.environ.get("MORPH_INGEST_CONCURRENCY", str(max(2, _CPUS // 2))))
+INGEST_QUEUE = int(os.environ.get("MORPH_INGEST_QUEUE", "8"))
+COMPUTE_CONCURRENCY = int(os.environ.get("MORPH_COMPUTE_CONCURRENCY", str(_CPUS)))
+COMPUTE_QUEUE = int(os.environ.get("MORPH_COMPUTE_QUEUE", "16"))
+# Longest a queued request waits for a slot before it is turned away.
+ADMISSION_WAIT_SECONDS = float(os.environ.get("MORPH_ADMISSION_WAIT_SECONDS", "5"))
+# Heavy requests one client (session) may have running at once.
+CLIENT_CONCURRENCY = int(os.environ.get("MORPH_CLIENT_CONCURRENCY", "2"))
+# Largest request body accepted, and total body bytes admitted at once, in megabytes.
+MAX_BODY_MB = int(os.environ.get("MORPH_MAX_BODY_MB", "256"))
+MAX_INFLIGHT_MB = int(os.environ.get("MORPH_MAX_INFLIGHT_MB", "512"))
+
+
+class EndpointClass:
+    """
+    A concurrency limit plus a bounded wait queue shared by a group of
+    endpoints: exact `paths`, and `patterns` for paths with parameters.
+    """
+
+    def __init__(self, name: str, paths: set, limit: int, queue: int, wait_seconds: float = ADMISSION_WAIT_SECONDS,
+                 patterns: tuple = ()):
+        self.name = name
+        self.paths = paths
+        self.patterns = [re.compile(p) for p in patterns]
+        self.limit = limit
+        self.queue = queue
+        self.wait_seconds = wait_seconds
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {"busy": 0, "client": 0, "too_large": 0}
+        self.avg_seconds = 1.0  # moving average of request time, for Retry-After
+        self._sem = None
+
+    async def acquire(self) -> bool:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        if self._sem.locked() and self.waiting >= self.queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self, seconds: float):
+        self.active -= 1
+        self._sem.release()
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work spread over the slots."""
+        return max(1, min(60, math.ceil(self.avg_seconds * (self.waiting + 1) / self.limit)))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "queue_limit": self.queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_ms": round(self.avg_seconds * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """Per-class slots, per-client limits and the body bytes in flight for one server process."""
+
+    def __init__(self, classes: list, client_limit: int = CLIENT_CONCURRENCY,
+                 max_body_bytes: int = MAX_BODY_MB * 1024 * 1024,
+                 max_inflight_bytes: int = MAX_INFLIGHT_MB * 1024 * 1024):
+        self.classes = classes
+        self.client_limit = client_limit
+        self.max_body_bytes = max_body_bytes
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_bytes = 0
+        self.clients = {}  # client key -> heavy requests running
+
+    def classify(self, method: str, path: str) -> EndpointClass | None:
+        if method != "POST":
+            return None
+        for endpoint_class in self.classes:
+            if path in endpoint_class.paths or any(p.fullmatch(path) for p in endpoint_class.patterns):
+                return endpoint_class
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "classes": {c.name: c.stats() for c in self.classes},
+            "bytes_in_flight": self.inflight_bytes,
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "max_body_bytes": self.max_body_bytes,
+            "clients_active": len(self.clients),
+        }
+
+
+ADMISSION = AdmissionController([
+    EndpointClass("ingest", {
+        "/api/process-file", "/api/upload", "/api/jobs/process-file",
+    }, INGEST_CONCURRENCY, INGEST_QUEUE),
+    EndpointClass("compute", {
+        "/api/clean-data", "/api/clean-data/plan", "/api/export-data", "/api/analyze/health", "/api/analyze/forecast",
+        "/api/analyze/duplicates",
+        "/api/jobs/clean-data", "/api/jobs/analyze/forecast", "/api/jobs/export-data",
+    }, COMPUTE_CONCURRENCY, COMPUTE_QUEUE, patterns=(
+        r"/api/datasets/[^/]+/versions",  # cleans a version into a new one
+    )),
+])
+
+
+def _reject(status_code: int, detail: str, retry_after: int | None = None) -> JSONResponse:
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+
+
+class _MeteredBody:
+    """
+    receive/send wrappers for a body without Content-Length (chunked
+    uploads). Bytes are charged to the in-flight total as they arrive;
+    past a limit the app sees the client disconnect, its response is
+    dropped, and `rejection` (413 or 503) is sent instead.
+    """
+
+    def __init__(self, controller: AdmissionController, endpoint_class: EndpointClass, receive, send):
+        self.controller = controller
+        self.endpoint_class = endpoint_class
+        self._receive = receive
+        self._send = send
+        self.received = 0
+        self.rejection = None
+        self.started = False
+
+    async def receive(self):
+        if self.rejection is not None:
+            return {"type": "http.disconnect"}
+        message = await self._receive()
+        if message["type"] == "http.request":
+            size = len(message.get("body", b""))
+            self.received += size
+            self.controller.inflight_bytes += size
+            controller = self.controller
+            if self.received > controller.max_body_bytes:
+                self.endpoint_class.rejected["too_large"] += 1
+                self.rejection = _reject(413, f"Request body is larger than the "
+                                              f"{controller.max_body_bytes // (1024 * 1024)} MB limit.")
+            elif controller.inflight_bytes > controller.max_inflight_bytes:
+                self.endpoint_class.rejected["busy"] += 1
+                self.rejection = _reject(503, "Server is busy with other uploads. Please retry shortly.",
+                                         self.endpoint_class.retry_after())
+            if self.rejection is not None and not self.started:
+                return {"type": "http.disconnect"}
+        return message
+
+    async def send(self, message):
+        if self.rejection is not None and not self.started:
+            return  # the app's reaction to the cut-off body; the rejection goes out instead
+        self.started = True
+        await self._send(message)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits heavy requests before their bodies are read.
+    Oversized bodies get 413, a client over its own limit gets 429, and a
+    full queue or too many body bytes in flight get 503, each with
+    Retry-After; everything else is untouched. Bodies without
+    Content-Length (chunked) are held to the same limits as they arrive.
+    """
+
+    def __init__(self, app, controller: AdmissionController = ADMISSION):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        endpoint_class = None
+        if scope["type"] == "http":
+            endpoint_class = self.controller.classify(scope["method"], scope["path"])
+        if endpoint_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        length = None
+        cookie_header = ""
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit():
+                length = int(value)
+            elif name == b"cookie":
+                cookie_header = value.decode("latin-1")
+
+        if length is not None and (length > controller.max_body_bytes or length > controller.max_inflight_bytes):
+            endpoint_class.rejected["too_large"] += 1
+            limit_mb = min(controller.max_body_bytes, controller.max_inflight_bytes) // (1024 * 1024)
+            response = _reject(413, f"Request body is larger than the {limit_mb} MB limit.")
+        else:
+            response = None
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        state = scope.get("state") or {}
+        client = state.get("session_id") or cookie_parser(cookie_header).get(SESSION_COOKIE) \
+            or (scope.get("client") or ("unknown",))[0]
+        if controller.clients.get(client, 0) >= controller.client_limit:
+            endpoint_class.rejected["client"] += 1
+            await _reject(429, "Too many requests in progress for this session. Please wait for them to finish.",
+                          endpoint_class.retry_after())(scope, receive, send)
+            return
+        if controller.inflight_bytes + (length or 0) > controller.max_inflight_bytes:
+            endpoint_class.rejected["busy"] += 1
+            await _reject(503, "Server is busy with other uploads. Please retry shortly.",
+                          endpoint_class.retry_after())(scope, receive, send)
+            return
+
+        # Reserve the client slot and body bytes while queued, so a burst can't overshoot
+        controller.clients[client] = controller.clients.get(client, 0) + 1
+        metered = None
+        if length is None:
+            metered = _MeteredBody(controller, endpoint_class, receive, send)
+        else:
+            controller.inflight_bytes += length
+        try:
+            if not await endpoint_class.acquire():
+                endpoint_class.rejected["busy"] += 1
+                await _reject(503, "Server is busy. Please retry shortly.",
+                              endpoint_class.retry_after())(scope, receive, send)
+                return
+            started = time.monotonic()
+            try:
+                if metered is None:
+                    await self.app(scope, receive, send)
+                else:
+                    try:
+                        await self.app(scope, metered.receive, metered.send)
+                    except Exception:
+                        if metered.rejection is None:
+                            raise
+                    if metered.rejection is not None and not metered.started:
+                        await metered.rejection(scope, receive, send)
+            finally:
+                endpoint_class.release(time.monotonic() - started)
+        finally:
+            controller.inflight_bytes -= length if metered is None else metered.received
+            controller.clients[client] -= 1
+            if not controller.clients[client]:
+                del controller.clients[client]
@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import pandas as pd
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.services.dataset_store import frame_from_payload
+from app.services.serializer import columnar_response, records_response
+from app.services.session import session_owner
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# Schema metadata key holding the JSON fields that accompany the rows
+ARROW_METADATA_KEY = b"morph"
+
+
+def wants_arrow(request: Request) -> bool:
+    """True when the client asked for an Arrow IPC stream instead of JSON."""
+    return ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def is_arrow_body(request: Request) -> bool:
+    return request.headers.get("content-type", "").startswith(ARROW_STREAM_MEDIA_TYPE)
+
+
+def _to_table(df: pd.DataFrame):
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        pass
+    # Mixed object columns (numbers and text) have no single Arrow type; send them as text
+    fixed = df.copy(deep=False)
+    for col in fixed.columns[fixed.dtypes == object]:
+        try:
+            pa.array(fixed[col], from_pandas=True)
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            fixed[col] = fixed[col].where(fixed[col].isna(), fixed[col].astype(str))
+    return pa.Table.from_pandas(fixed, preserve_index=False)
+
+
+def frame_to_arrow_bytes(df: pd.DataFrame, metadata: dict | None = None) -> bytes:
+    """
+    Serializes a frame as an Arrow IPC stream. Numeric columns are written
+    straight from their buffers; metadata travels in the schema.
+    """
+    import pyarrow as pa
+
+    table = _to_table(df)
+    if metadata:
+        schema_meta = dict(table.schema.metadata or {})
+        schema_meta[ARROW_METADATA_KEY] = json.dumps(metadata, default=str).encode()
+        table = table.replace_schema_metadata(schema_meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_response(df: pd.DataFrame, metadata: dict | None = None) -> Response:
+    """
+    Arrow IPC response. The scalar fields of the JSON response are carried
+    both in the schema metadata and as X-Morph-* headers.
+    """
+    headers = {}
+    for key, value in (metadata or {}).items():
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            headers[f"X-Morph-{key.replace('_', '-').title()}"] = str(value)
+    return Response(
+        content=frame_to_arrow_bytes(df, metadata),
+        media_type=ARROW_STREAM_MEDIA_TYPE,
+        headers=headers,
+    )
+
+
+def frame_response(request: Request, meta: dict, df: pd.DataFrame, format: str | None = None, nan: str = "null"):
+    """
+    Response for a frame plus its metadata fields: an Arrow IPC stream when the
+    client accepts one, the columnar body for format == "columnar", otherwise
+    row objects with a headers list (missing -> `nan`). Both JSON bodies
+    send Infinity as 0.
+    """
+    if wants_arrow(request):
+        return arrow_response(df, meta)
+    if format == "columnar":
+        return columnar_response(meta, df, inf="0")
+    meta = dict(meta, headers=df.columns.tolist())
+    return records_response(meta, df, nan=nan, inf="0")
+
+
+def frame_from_arrow_bytes(body: bytes) -> pd.DataFrame:
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(pa.py_buffer(body)).read_all().to_pandas()
+
+
+async def read_frame_request(request: Request) -> tuple[dict, pd.DataFrame]:
+    """
+    Reads the dataset a request refers to and its options.
+    Arrow bodies carry the rows and take options from the query string;
+    JSON bodies use a dataset_id or inline rows (see frame_from_payload).
+    Raises DatasetNotFound for dataset IDs this session doesn't hold.
+    Decoding and dataset lookups (which may reload a spilled dataset from
+    disk) run on a thread, off the event loop.
+    """
+    if is_arrow_body(request):
+        body = await request.body()
+        return dict(request.query_params), await asyncio.to_thread(frame_from_arrow_bytes, body)
+    data = await request.json()
+    return data, await asyncio.to_thread(frame_from_payload, data, session_owner(request))
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from app.services.dedup import duplicated_rows, filter_rows, row_fingerprints
+
+# Rows scanned for a header, and the words that make a row look like one
+HEADER_SCAN_ROWS = 20
+HEADER_KEYWORDS = ('id', 'name', 'date', 'price', 'cost', 'stock', 'sku', 'total', 'sales', 'profit', 'category')
+
+def header_scores(block: pd.DataFrame) -> np.ndarray:
+    """
+    Header score of every row in `block`: one point per non-blank text cell
+    plus 5 per keyword in the row's text, str(row.tolist()).lower(). The
+    block is converted to Python objects once (not a Series per row), text
+    cells are counted with pandas string methods over all cells, and each
+    keyword is one str.contains over the row texts.
+    """
+    scores = np.zeros(len(block), dtype=np.int64)
+    if not len(block) or not block.shape[1]:
+        return scores
+    values = block.to_numpy(dtype=object)
+    cells = pd.Series(values.ravel(), dtype=object)
+    try:
+        # Non-string cells come back NaN; Python's strip, as the object-dtype methods use
+        scores += (cells.str.strip().str.len() > 0).to_numpy().reshape(values.shape).sum(axis=1)
+    except AttributeError:
+        pass  # .str refuses blocks that hold no strings at all
+    rows = pd.Series([str(row) for row in values.tolist()], dtype=object).str.lower()
+    for keyword in HEADER_KEYWORDS:
+        scores += 5 * rows.str.contains(keyword, regex=False).to_numpy(dtype=bool)
+    return scores
+
+
+def perform_cleaning(df, fingerprints=None, with_sources=False):
+    """
+    Smart Cleaning with Correct "Rows Removed" Count.
+    1. Finds & Promotes Header (Does not count this as 'removed').
+    2. Deletes ONLY true junk rows.
+    `fingerprints` are the input frame's row fingerprints, if already built;
+    they are only used when the header and columns are left as they are.
+    With `with_sources`, also returns the input positions of the kept rows
+    and columns (for delta responses).
+    Infinities become 0, as they always have. Empty cells stay missing
+    (NaN/None) rather than "": clean responses still write them as "", but
+    consumers of the registered dataset see them as missing values (health
+    counts them, forecast drops them, exports write empty cells).
+    """
+    original = df
+    initial_rows = len(df)
+    header_fixed = False # Flag to track if we moved a header
+    first_row = 0
+
+    # --- 1. SMART HEADER DETECTION ---
+    first_col = str(df.columns[0])
+    if first_col.startswith('Unnamed') or "Sample" in first_col or "Data" in first_col:
+        
+        best_row_index = -1
+        max_score = 0
+        scores = header_scores(df.iloc[:HEADER_SCAN_ROWS])
+        if len(scores) and scores.max() > 0:
+            # First row with the top score wins
+            best_row_index = int(scores.argmax())
+            max_score = int(scores[best_row_index])
+        
+        # Promote the winner row to Header
+        if best_row_index != -1 and max_score > 2:
+            new_header = df.iloc[best_row_index]
+            first_row = best_row_index + 1
+            df = df.iloc[first_row:]
+            
+            cleaned_columns = []
+            for i, val in enumerate(new_header):
+                if pd.isna(val) or str(val).strip() == "":
+                    cleaned_columns.append(f"Column_{i+1}")
+                else:
+                    cleaned_columns.append(str(val).strip())
+            df.columns = cleaned_columns
+            df = df.reset_index(drop=True)
+            header_fixed = True # We moved a row to header!
+
+    # --- 2. SAFE CLEANING ---
+    # Remove "Unnamed" columns only if safe
+    column_sources = [j for j, c in enumerate(df.columns)
+                      if not str(c).startswith('Unnamed') and not str(c).startswith('Column_')]
+    # (re-selecting every column would only copy the frame and lose its fingerprints)
+    if 0 < len(column_sources) < df.shape[1]:
+        df = df.iloc[:, column_sources]
+    else:
+        column_sources = list(range(df.shape[1]))
+
+    # Drop Duplicates & Empty Rows, as one filter over the row fingerprints
+    if fingerprints is None or df is not original:
+        fingerprints = row_fingerprints(df)
+    keep = ~duplicated_rows(df, fingerprints) & df.notna().any(axis=1).to_numpy()
+    if not keep.all():
+        df = filter_rows(df, keep, fingerprints)
+    
+    # Infinity -> 0, only in the float columns that have any (no whole-frame copy);
+    # empty cells are written as "" by the response encoder instead of a fillna("") copy
+    with_inf = [j for j in range(df.shape[1])
+                if df.dtypes.iloc[j].kind == "f" and np.isinf(df.iloc[:, j].to_numpy()).any()]
+    if with_inf:
+        df = df.copy(deep=False)
+        for j in with_inf:
+            df.isetitem(j, df.iloc[:, j].replace([np.inf, -np.inf], 0))
+
+    # --- 3. CALCULATE "TRUE" REMOVED ROWS ---
+    final_rows = len(df)
+    rows_removed = initial_rows - final_rows
+    
+    # FIX: If we promoted a header, don't count it as "Removed data"
+    if header_fixed:
+        rows_removed -= 1
+        
+    # Ensure we never show negative numbers
+    rows_removed = max(0, rows_removed)
+
+    if with_sources:
+        return df, rows_removed, (first_row + np.flatnonzero(keep), column_sources)
+    return df, rows_removed
@@ -0,0 +1,338 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.dedup import duplicated_rows, filter_rows
+
+# Spellings the "boolean" coercion understands (after trimming and lower-casing)
+TRUE_WORDS = ("true", "t", "yes", "y", "1")
+FALSE_WORDS = ("false", "f", "no", "n", "0")
+COERCE_TYPES = ("number", "integer", "date", "text", "boolean")
+
+
+class PlanError(ValueError):
+    """A cleaning plan the client sent that can't be run as written."""
+
+
+def _is_text_column(s: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype)
+
+
+def empty_mask(s: pd.Series) -> np.ndarray:
+    """Cells that are missing or hold only whitespace."""
+    empty = s.isna().to_numpy()
+    if _is_text_column(s):
+        blank = s.str.strip().eq("")
+        empty = empty | blank.fillna(False).to_numpy(dtype=bool)
+    return empty
+
+
+# --- Column steps: (series, params) -> (new series, mask of rows the step changed) ---
+
+def _trim(s: pd.Series, params: dict) -> tuple:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Trim the categories, merging any that become equal
+        categories = s.cat.categories.to_series()
+        if not _is_text_column(categories):
+            return s, None
+        trimmed, renamed = _trim(categories, params)
+        merged, remap = pd.factorize(trimmed)
+        codes = s.cat.codes.to_numpy()
+        new_codes = np.where(codes >= 0, merged[np.maximum(codes, 0)], -1)
+        out = pd.Series(pd.Categorical.from_codes(new_codes, categories=remap), index=s.index, name=s.name)
+        return out, (codes >= 0) & renamed[np.maximum(codes, 0)]
+    if not _is_text_column(s):
+        return s, None
+    stripped = s.str.strip()
+    if pd.api.types.is_object_dtype(s.dtype):
+        # .str gives NaN for non-text cells (numbers in a mixed column); keep those as they were
+        stripped = s.where(stripped.isna(), stripped)
+    changed = (stripped != s).fillna(False).to_numpy(dtype=bool) & s.notna().to_numpy()
+    return stripped, changed
+
+
+def _fill(s: pd.Series, params: dict) -> tuple:
+    empty = empty_mask(s)
+    if not empty.any():
+        return s, None
+    value = params["value"]
+    try:
+        filled = s.mask(empty, value)
+    except (TypeError, ValueError):
+        # e.g. text into a numeric column: the column becomes mixed
+        filled = s.astype(object).mask(empty, value)
+    return filled, empty
+
+
+def _to_boolean(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_bool_dtype(s.dtype):
+        return s.astype("boolean")
+    if pd.api.types.is_numeric_dtype(s.dtype):
+        return s.map({1: True, 0: False}).astype("boolean")
+    words = s.astype("str").str.strip().str.lower()
+    out = pd.Series(pd.NA, index=s.index, dtype="boolean")
+    out[words.isin(TRUE_WORDS).to_numpy(dtype=bool)] = True
+    out[words.isin(FALSE_WORDS).to_numpy(dtype=bool)] = False
+    return out
+
+
+def _coerce(s: pd.Series, params: dict) -> tuple:
+    kind = params["type"]
+    if kind == "number":
+        out = pd.to_numeric(s, errors="coerce")
+    elif kind == "integer":
+        numbers = pd.to_numeric(s, errors="coerce")
+        out = numbers.where(numbers % 1 == 0).astype("Int64")
+    elif kind == "date":
+        out = s if pd.api.types.is_datetime64_any_dtype(s.dtype) else pd.to_datetime(s, errors="coerce", format="mixed")
+    elif kind == "text":
+        # "string" keeps missing cells <NA> on every pandas version ("str" gives "nan" on 2.x)
+        out = s.astype("string")
+        if s.dtype.kind == "f":
+            out = out.str.replace(r"\.0$", "", regex=True)  # 3.0 -> "3", as it was typed
+    else:
+        out = _to_boolean(s)
+    # Rows affected: values that couldn't be converted and are now missing
+    lost = ~empty_mask(s) & out.isna().to_numpy()
+    return out, lost
+
+
+# --- Row steps: (frame, params, rows still kept) -> mask of rows to drop ---
+
+def _drop_empty(df: pd.DataFrame, params: dict, keep: np.ndarray) -> np.ndarray:
+    masks = [empty_mask(df.iloc[:, j]) for j in params["positions"]]
+    if not masks:
+        return np.zeros(len(df), dtype=bool)
+    combine = np.logical_and if params["how"] == "all" else np.logical_or
+    return combine.reduce(masks)
+
+
+def _dedup(df: pd.DataFrame, params: dict, keep: np.ndarray, fingerprints=None) -> np.ndarray:
+    positions = params["positions"]
+    rows = np.flatnonzero(keep)
+    if fingerprints is not None and params["keep"] == "first" \
+            and len(positions) == df.shape[1] and len(rows) == len(df):
+        # The dataset's cached duplicate index answers a whole-row dedup for free
+        repeated = duplicated_rows(df, fingerprints)
+    else:
+        subset = df.iloc[rows, positions] if len(rows) < len(df) else df.iloc[:, positions]
+        repeated = subset.duplicated(keep=params["keep"]).to_numpy()
+    drop = np.zeros(len(df), dtype=bool)
+    drop[rows[repeated]] = True
+    return drop
+
+
+COLUMN_STEPS = {"trim": _trim, "fill": _fill, "coerce": _coerce}
+ROW_STEPS = {"drop_empty": _drop_empty, "dedup": _dedup}
+
+
+class PlanStep:
+    """One validated step. Column steps map columns to new columns; row steps drop rows."""
+
+    __slots__ = ("index", "op", "kind", "columns", "reads", "params")
+
+    def __init__(self, index: int, op: str, kind: str, columns: dict, reads: set, params: dict):
+        self.index = index
+        self.op = op
+        self.kind = kind
+        self.columns = columns  # column step: position -> params for that column
+        self.reads = reads      # row step: positions the decision depends on
+        self.params = params
+
+    def commutes_with(self, step: "PlanStep") -> bool:
+        """Whether this row step may run before `step`, a column step, without changing the result."""
+        if step.op != "trim":
+            return False  # fill/coerce pick the result's dtype from the rows they see
+        if self.op == "drop_empty":
+            return True  # trimming never turns an empty cell into a non-empty one, or back
+        return not (self.reads & step.columns.keys())
+
+
+class CleaningPlan:
+    """A compiled plan: the client's steps, the order they run in, and the passes they are fused into."""
+
+    def __init__(self, steps: list, passes: list):
+        self.steps = steps
+        self.passes = passes  # lists of PlanSteps, all column steps or all row steps
+
+
+def _resolve_columns(columns: pd.Index, names, step_no: int) -> list:
+    """Positions of the named columns, all columns for None (names also match str(column))."""
+    if names is None:
+        return list(range(len(columns)))
+    if isinstance(names, str) or not isinstance(names, (list, tuple)):
+        names = [names]
+    labels = [str(c) for c in columns]
+    positions = []
+    for name in names:
+        found = [j for j, c in enumerate(columns) if c == name] or \
+            [j for j, label in enumerate(labels) if label == str(name)]
+        if not found:
+            raise PlanError(f"Step {step_no}: unknown column '{name}'.")
+        positions.extend(j for j in found if j not in positions)
+    return positions
+
+
+def _compile_step(index: int, raw: dict, columns: pd.Index) -> PlanStep:
+    step_no = index + 1
+    if not isinstance(raw, dict) or "op" not in raw:
+        raise PlanError(f"Step {step_no}: expected an object with an 'op'.")
+    op = raw["op"]
+    if op == "trim":
+        positions = _resolve_columns(columns, raw.get("columns"), step_no)
+        return PlanStep(index, op, "columns", {j: {} for j in positions}, set(), {})
+    if op == "fill":
+        if isinstance(raw.get("values"), dict):
+            per_column = {}
+            for name, value in raw["values"].items():
+                for j in _resolve_columns(columns, [name], step_no):
+                    per_column[j] = {"value": value}
+        elif "value" in raw:
+            positions = _resolve_columns(columns, raw.get("columns"), step_no)
+            per_column = {j: {"value": raw["value"]} for j in positions}
+        else:
+            raise PlanError(f"Step {step_no}: fill needs 'values' ({{column: value}}) or 'value'.")
+        return PlanStep(index, op, "columns", per_column, set(), {})
+    if op == "coerce":
+        types = raw.get("types")
+        if not isinstance(types, dict) or not types:
+            raise PlanError(f"Step {step_no}: coerce needs 'types' ({{column: type}}).")
+        per_column = {}
+        for name, kind in types.items():
+            if kind not in COERCE_TYPES:
+                raise PlanError(f"Step {step_no}: unknown type '{kind}' (expected one of {', '.join(COERCE_TYPES)}).")
+            for j in _resolve_columns(columns, [name], step_no):
+                per_column[j] = {"type": kind}
+        return PlanStep(index, op, "columns", per_column, set(), {})
+    if op == "drop_empty":
+        how = raw.get("how", "all")
+        if how not in ("all", "any"):
+            raise PlanError(f"Step {step_no}: 'how' must be 'all' or 'any'.")
+        positions = _resolve_columns(columns, raw.get("columns"), step_no)
+        return PlanStep(index, op, "rows", {}, set(positions), {"positions": positions, "how": how})
+    if op == "dedup":
+        keep = raw.get("keep", "first")
+        if keep not in ("first", "last"):
+            raise PlanError(f"Step {step_no}: 'keep' must be 'first' or 'last'.")
+        positions = _resolve_columns(columns, raw.get("columns") or raw.get("keys"), step_no)
+        return PlanStep(index, op, "rows", {}, set(positions), {"positions": positions, "keep": keep})
+    known = ", ".join(list(COLUMN_STEPS) + list(ROW_STEPS))
+    raise PlanError(f"Step {step_no}: unknown op '{op}' (expected one of {known}).")
+
+
+def compile_plan(steps, columns) -> CleaningPlan:
+    """
+    Validates the client's steps against the frame's columns and plans their
+    execution. Row steps run as early as they can without changing the result
+    (fewer rows for the column steps after them), then runs of steps of the
+    same kind are fused: column steps into one pass over the columns, row
+    steps into one combined filter.
+    """
+    if isinstance(steps, str):
+        try:
+            steps = json.loads(steps)  # Arrow requests pass options in the query string
+        except ValueError:
+            raise PlanError("'steps' is not valid JSON.")
+    if not isinstance(steps, list) or not steps:
+        raise PlanError("'steps' must be a non-empty list.")
+    columns = pd.Index(columns)
+    compiled = [_compile_step(i, raw, columns) for i, raw in enumerate(steps)]
+
+    order = []
+    for step in compiled:
+        at = len(order)
+        if step.kind == "rows":
+            while at > 0 and order[at - 1].kind == "columns" and step.commutes_with(order[at - 1]):
+                at -= 1
+        order.insert(at, step)
+
+    passes = []
+    for step in order:
+        if passes and passes[-1][0].kind == step.kind:
+            passes[-1].append(step)
+        else:
+            passes.append([step])
+    return CleaningPlan(compiled, passes)
+
+
+def _run_column_pass(df: pd.DataFrame, steps: list, affected: dict, seconds: dict) -> pd.DataFrame:
+    out = df.copy(deep=False)
+    touched = sorted({j for step in steps for j in step.columns})
+    for j in touched:
+        column = df.iloc[:, j]
+        for step in steps:
+            params = step.columns.get(j)
+            if params is None:
+                continue
+            started = time.perf_counter()
+            column, changed = COLUMN_STEPS[step.op](column, params)
+            if changed is not None:
+                affected[step.index] |= changed
+            seconds[step.index] += time.perf_counter() - started
+        out.isetitem(j, column)
+    return out
+
+
+def _run_row_pass(df: pd.DataFrame, steps: list, affected: dict, seconds: dict, fingerprints=None) -> pd.DataFrame:
+    keep = np.ones(len(df), dtype=bool)
+    for step in steps:
+        started = time.perf_counter()
+        if step.op == "dedup":
+            drop = _dedup(df, step.params, keep, fingerprints)
+        else:
+            drop = ROW_STEPS[step.op](df, step.params, keep)
+        drop &= keep
+        affected[step.index] |= drop
+        keep &= ~drop
+        seconds[step.index] += time.perf_counter() - started
+    if keep.all():
+        return df, keep
+    if fingerprints is not None:
+        return filter_rows(df, keep, fingerprints), keep
+    return df[keep], keep
+
+
+def run_plan(df: pd.DataFrame, plan: CleaningPlan, fingerprints=None, with_sources: bool = False) -> tuple:
+    """
+    Runs a compiled plan; returns the cleaned frame and a report with each
+    step's time and rows affected (rows removed for row steps; rows with a
+    trimmed or filled cell, or a value that failed to convert, for column
+    steps, counted over the rows it ran on). `fingerprints` are the input
+    frame's row fingerprints, if already built. With `with_sources`, also
+    returns the input positions of the kept rows and columns, as
+    perform_cleaning does.
+    """
+    started = time.perf_counter()
+    seconds = {step.index: 0.0 for step in plan.steps}
+    affected = {}
+    passes = []
+    current = df
+    rows = np.arange(len(df))
+    for steps in plan.passes:
+        pass_started = time.perf_counter()
+        local = {step.index: np.zeros(len(current), dtype=bool) for step in steps}
+        if steps[0].kind == "columns":
+            current = _run_column_pass(current, steps, local, seconds)
+        else:
+            current, keep = _run_row_pass(current, steps, local, seconds, fingerprints if current is df else None)
+            rows = rows[keep]
+        affected.update((index, int(mask.sum())) for index, mask in local.items())
+        passes.append({"kind": steps[0].kind, "steps": [s.index for s in steps],
+                       "ms": round((time.perf_counter() - pass_started) * 1000, 2)})
+    report = {
+        "rows_before": len(df),
+        "rows_after": len(current),
+        "steps": [{
+            "index": step.index,
+            "op": step.op,
+            "rows_affected": affected[step.index],
+            "ms": round(seconds[step.index] * 1000, 2),
+        } for step in plan.steps],
+        "passes": passes,
+        "total_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    if with_sources:
+        return current, report, (rows, list(range(df.shape[1])))
+    return current, report
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional: brotli responses are only offered when installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd responses are only offered when installed
+    zstandard = None
+
+# Responses smaller than this are sent as-is; compressing them costs more than it saves.
+COMPRESSION_MIN_BYTES = int(os.environ.get("MORPH_COMPRESSION_MIN_BYTES", "1024"))
+
+# Already-compressed payloads (xlsx is a zip) aren't worth a second pass.
+_SKIP_MEDIA_PREFIXES = (
+    "image/", "video/", "audio/",
+    "application/zip", "application/gzip", "application/x-gzip",
+    "application/vnd.openxmlformats-officedocument",
+)
+
+# (size threshold in bytes, gzip level, brotli quality, zstd level); first match wins.
+# Bigger payloads get cheaper levels so CPU time stays bounded.
+_LEVELS = [
+    (1 * 1024 * 1024, 6, 5, 3),
+    (16 * 1024 * 1024, 5, 4, 3),
+    (None, 3, 2, 1),
+]
+# Level used when the final size isn't known up front (streamed bodies).
+_STREAMING_LEVEL = _LEVELS[1]
+# Streamed bodies without a Content-Length are held up to this size before compressing,
+# so one that ends by then is skipped or leveled by its real size.
+_HOLD_BYTES = _LEVELS[0][0]
+
+
+def available_encodings() -> list:
+    """Encodings this process can produce, in server preference order."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    Picks the response encoding from an Accept-Encoding header, honouring
+    q-values; ties go to the server preference order (zstd, br, gzip).
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _levels_for(size: int | None) -> tuple:
+    if size is None:
+        return _STREAMING_LEVEL
+    for entry in _LEVELS:
+        if entry[0] is None or size <= entry[0]:
+            return entry
+    return _LEVELS[-1]
+
+
+class _Compressor:
+    """Uniform incremental interface over gzip, brotli and zstd."""
+
+    def __init__(self, encoding: str, size: int | None):
+        _, gzip_level, brotli_quality, zstd_level = _levels_for(size)
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._obj = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+class CompressionStats:
+    """Per-route totals of bytes in/out and compression CPU time."""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, encoding: str, bytes_in: int, bytes_out: int, cpu_seconds: float):
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                "responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0, "encodings": {},
+            })
+            entry["responses"] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["cpu_ms"] += cpu_seconds * 1000
+            entry["encodings"][encoding] = entry["encodings"].get(encoding, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {}
+            for route, entry in self._routes.items():
+                out[route] = dict(entry, encodings=dict(entry["encodings"]))
+                out[route]["ratio"] = round(entry["bytes_in"] / entry["bytes_out"], 2) if entry["bytes_out"] else None
+                out[route]["cpu_ms"] = round(entry["cpu_ms"], 2)
+            return out
+
+
+COMPRESSION_STATS = CompressionStats()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses response bodies incrementally as they
+    stream, using the best encoding the client accepts.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES, stats: CompressionStats = COMPRESSION_STATS):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(scope, send, encoding, self.minimum_size, self.stats))
+
+
+class _CompressingSend:
+    """The `send` callable handed to the app; holds per-response state."""
+
+    def __init__(self, scope, send, encoding: str, minimum_size: int, stats: CompressionStats):
+        self.scope = scope
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.stats = stats
+        self.start = None
+        self.held = []
+        self.held_bytes = 0
+        self.passthrough = False
+        self.compressor = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu = 0.0
+
+    def _route(self) -> str:
+        # The router records the matched route on the shared scope; use its template,
+        # under the prefix of any mount it sits in
+        path = getattr(self.scope.get("route"), "path", None)
+        if path is None:
+            return self.scope.get("path", "")
+        return self.scope.get("root_path", "") + path
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = {k.lower(): v for k, v in message.get("headers", [])}
+            media_type = headers.get(b"content-type", b"").decode("latin-1")
+            if b"content-encoding" in headers or media_type.startswith(_SKIP_MEDIA_PREFIXES):
+                self.passthrough = True
+                await self.send(message)
+            else:
+                self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            if self.start is not None and self.compressor is None and not self.passthrough:
+                # e.g. http.response.pathsend: the body isn't ours to compress
+                self.passthrough = True
+                await self.send(self.start)
+                if self.held:
+                    await self.send({"type": "http.response.body", "body": b"".join(self.held), "more_body": True})
+                    self.held = []
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            size = None
+            for name, value in self.start.get("headers", []):
+                if name.lower() == b"content-length":
+                    size = int(value)
+            # Hold the first chunks: streamed bodies start with more_body set even when tiny
+            self.held.append(body)
+            self.held_bytes += len(body)
+            enough = self.minimum_size if size is not None else max(self.minimum_size, _HOLD_BYTES)
+            if more_body and self.held_bytes < enough:
+                return
+            body, self.held = b"".join(self.held), []
+            if not more_body and len(body) < self.minimum_size:
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            if size is None and not more_body:
+                size = len(body)
+            self.compressor = _Compressor(self.encoding, size)
+            headers = [(k, v) for k, v in self.start.get("headers", []) if k.lower() != b"content-length"]
+            headers.append((b"content-encoding", self.encoding.encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            await self.send(dict(self.start, headers=headers))
+
+        began = time.thread_time()
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        self.cpu += time.thread_time() - began
+        self.bytes_in += len(body)
+        self.bytes_out += len(chunk)
+
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if not more_body:
+            self.stats.record(self._route(), self.encoding, self.bytes_in, self.bytes_out, self.cpu)
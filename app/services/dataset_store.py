@@ -0,0 +1,412 @@
+import atexit
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from app.services.parse_cache import frame_nbytes
+from app.services.shared_store import SHARED_DATASETS, SharedDatasetStore
+
+# Process-wide memory budget for server-held datasets, in megabytes.
+DATASET_BUDGET_MB = int(os.environ.get("MORPH_DATASET_BUDGET_MB", "1024"))
+# How many datasets one owner (session) may hold before their oldest is dropped.
+MAX_DATASETS_PER_OWNER = int(os.environ.get("MORPH_MAX_DATASETS_PER_OWNER", "16"))
+# Set MORPH_DATASET_SPILL=0 to evict over-budget datasets instead of spilling them to disk.
+SPILL_DATASETS = os.environ.get("MORPH_DATASET_SPILL", "1") != "0"
+# Datasets untouched for this many seconds are written to disk and dropped from the heap.
+SPILL_IDLE_SECONDS = int(os.environ.get("MORPH_DATASET_IDLE_SECONDS", "300"))
+# Disk budget for spilled datasets, in megabytes; past it the oldest are deleted.
+SPILL_MAX_MB = int(os.environ.get("MORPH_DATASET_SPILL_MB", "10240"))
+# Where spill files go (defaults to a private directory under the system temp dir).
+SPILL_DIR = os.environ.get("MORPH_DATASET_SPILL_DIR") or None
+
+
+class DatasetNotFound(KeyError):
+    """Raised when a dataset_id is unknown, evicted, or belongs to another owner."""
+
+
+class DatasetTooLarge(ValueError):
+    """Raised when a single frame is bigger than the whole dataset budget."""
+
+
+def _write_spill(df: pd.DataFrame, path: str) -> int | None:
+    """
+    Writes a frame as an Arrow IPC file and returns its size, or None when the
+    frame can't round-trip (non-text column names, mixed object columns).
+    """
+    import pyarrow as pa
+
+    if not all(isinstance(c, str) for c in df.columns) or not df.columns.is_unique:
+        return None
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return os.path.getsize(path)
+
+
+def _read_spill(path: str, columns: list | None = None) -> pd.DataFrame:
+    """
+    Opens a spill file memory-mapped; with `columns` only those columns
+    (plus the stored index) are paged in.
+    """
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            index_columns = [c for c in table.schema.pandas_metadata.get("index_columns", []) if isinstance(c, str)]
+            table = table.select(list(columns) + index_columns)
+        return table.to_pandas(split_blocks=True)
+
+
+class _Entry:
+    __slots__ = ("owner", "df", "nbytes", "columns", "path", "disk_bytes", "last_used", "spilling", "shared")
+
+    def __init__(self, owner: str, df: pd.DataFrame | None, nbytes: int, columns: list | None = None):
+        self.owner = owner
+        self.df = df  # None while the dataset only lives in its spill (or shared) file
+        self.nbytes = nbytes
+        self.columns = list(df.columns) if columns is None else columns
+        self.path = None
+        self.disk_bytes = 0
+        self.last_used = time.monotonic()
+        self.spilling = False
+        self.shared = False  # path is in the shared store, which owns the file
+
+
+class DatasetRegistry:
+    """
+    Server-held frames keyed by owner plus dataset ID.
+
+    Sizes are measured with memory_usage(deep=True). Datasets that sit idle,
+    or that push the total over the process-wide budget (least recently used
+    first), are spilled to Arrow files and dropped from the heap; the next
+    access reopens them memory-mapped. Frames that can't be spilled, and
+    spill files past the disk budget, are evicted outright.
+    Each owner also has a "current" dataset, the one /api/chart and
+    /api/summary read.
+    With a `shared` store, datasets are also published there; a dataset
+    another worker registered is attached on first access and read from the
+    shared file as if it had been spilled, and "current" follows the owner's
+    latest upload on any worker.
+    Registered frames are shared with callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int, max_per_owner: int, spill: bool = SPILL_DATASETS,
+                 idle_seconds: int = SPILL_IDLE_SECONDS, max_disk_bytes: int = SPILL_MAX_MB * 1024 * 1024,
+                 spill_dir: str | None = SPILL_DIR, shared: SharedDatasetStore | None = None):
+        self.max_bytes = max_bytes
+        self.max_per_owner = max_per_owner
+        self.spill = spill
+        self.idle_seconds = idle_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self._spill_root = spill_dir
+        self._spill_dir = None
+        self.shared = shared
+        self._last_collect = 0.0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._current: dict = {}  # owner -> dataset_id
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.spills = 0
+        self.reloads = 0
+
+    def register(self, owner: str, df: pd.DataFrame, make_current: bool = False) -> str:
+        nbytes = frame_nbytes(df)  # measured outside the lock; deep sizing walks every object
+        if nbytes > self.max_bytes:
+            raise DatasetTooLarge(
+                f"Dataset needs {nbytes / 2**20:.1f} MB, over the {self.max_bytes / 2**20:.0f} MB server limit."
+            )
+        dataset_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[dataset_id] = _Entry(owner, df, nbytes)
+            self._bytes += nbytes
+            if make_current:
+                self._current[owner] = dataset_id
+            owned = [key for key, entry in self._entries.items() if entry.owner == owner]
+            for key in owned[:max(0, len(owned) - self.max_per_owner)]:
+                self._evict(key)
+        if self.shared is not None:
+            self._publish(owner, dataset_id, df, make_current)
+        self._relieve(keep=dataset_id)
+        return dataset_id
+
+    def _publish(self, owner: str, dataset_id: str, df: pd.DataFrame, make_current: bool):
+        try:
+            path = self.shared.publish(dataset_id, owner, df, make_current)
+            if time.monotonic() - self._last_collect > 60:
+                self._last_collect = time.monotonic()
+                self.shared.collect()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Shared dataset publish failed: {e}")
+            return
+        if path is None:
+            return
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is not None and entry.path is None:
+                # The shared file doubles as the spill file, so spilling this frame costs nothing
+                entry.path, entry.shared = path, True
+                return
+        self.shared.release(dataset_id)
+
+    def _attach(self, owner: str, dataset_id: str):
+        """Adds a dataset another worker published, without loading it."""
+        try:
+            found = self.shared.acquire(dataset_id, owner)
+        except sqlite3.Error as e:
+            print(f"Shared dataset lookup failed: {e}")
+            return
+        if found is None:
+            return
+        path, columns = found
+        with self._lock:
+            if dataset_id in self._entries:
+                return
+            entry = _Entry(owner, None, 0, columns)
+            entry.path, entry.shared = path, True
+            self._entries[dataset_id] = entry
+
+    def get(self, owner: str, dataset_id: str, columns: list | None = None) -> pd.DataFrame:
+        """
+        Returns the frame, reloading it from its spill file if needed. When
+        `columns` are given and the dataset is on disk, only those columns
+        are read and the dataset stays spilled.
+        """
+        if self.shared is not None and dataset_id not in self._entries:
+            self._attach(owner, dataset_id)
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None or entry.owner != owner:
+                raise DatasetNotFound(dataset_id)
+            self._entries.move_to_end(dataset_id)
+            entry.last_used = time.monotonic()
+            df = entry.df
+            if df is None:
+                path = entry.path
+                projected = columns is not None and all(c in entry.columns for c in columns)
+        if df is None:
+            df = self._reload(dataset_id, path, columns if projected else None)
+        self._relieve(keep=dataset_id)
+        return df
+
+    def columns(self, owner: str, dataset_id: str) -> list:
+        """Column names of a dataset, without loading it."""
+        if self.shared is not None and dataset_id not in self._entries:
+            self._attach(owner, dataset_id)
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None or entry.owner != owner:
+                raise DatasetNotFound(dataset_id)
+            return list(entry.columns)
+
+    def current(self, owner: str) -> pd.DataFrame | None:
+        dataset_id = None
+        if self.shared is not None:
+            try:
+                dataset_id = self.shared.current(owner)
+            except sqlite3.Error as e:
+                print(f"Shared dataset lookup failed: {e}")
+        if dataset_id is None:
+            with self._lock:
+                dataset_id = self._current.get(owner)
+        if dataset_id is None:
+            return None
+        try:
+            return self.get(owner, dataset_id)
+        except DatasetNotFound:
+            return None
+
+    def _reload(self, dataset_id: str, path: str, columns: list | None) -> pd.DataFrame:
+        try:
+            df = _read_spill(path, columns)
+        except OSError:
+            raise DatasetNotFound(dataset_id)  # spill file removed by an eviction in the meantime
+        if columns is not None:
+            return df
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return df
+            if entry.df is None:
+                entry.df, entry.nbytes = df, nbytes
+                self._bytes += nbytes
+                self.reloads += 1
+            return entry.df
+
+    def _relieve(self, keep: str):
+        """Spills idle and over-budget datasets; anything that can't be spilled is evicted."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            excess = self._bytes - self.max_bytes
+            for dataset_id, entry in self._entries.items():
+                if entry.df is None or entry.spilling or dataset_id == keep:
+                    continue
+                idle = self.idle_seconds and now - entry.last_used > self.idle_seconds
+                if idle or excess > 0:
+                    candidates.append(dataset_id)
+                    excess -= entry.nbytes
+            if not self.spill:
+                for dataset_id in candidates:
+                    if self._bytes > self.max_bytes:
+                        self._evict(dataset_id)
+                return
+            for dataset_id in candidates:
+                self._entries[dataset_id].spilling = True
+
+        for dataset_id in candidates:
+            self._spill_one(dataset_id)
+
+    def _spill_one(self, dataset_id: str):
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return
+            df, path = entry.df, entry.path
+        disk_bytes = None
+        if path is None:
+            path = os.path.join(self._ensure_spill_dir(), f"{dataset_id}.arrow")
+            try:
+                disk_bytes = _write_spill(df, path)
+            except OSError as e:
+                print(f"Dataset spill failed: {e}")
+            if disk_bytes is None and os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                if disk_bytes is not None:
+                    os.remove(path)
+                return
+            entry.spilling = False
+            if entry.path is None and disk_bytes is None:
+                # Can't be written out; only evict when the budget forces it
+                if self._bytes > self.max_bytes:
+                    self._evict(dataset_id)
+                return
+            if entry.path is None:
+                entry.path, entry.disk_bytes = path, disk_bytes
+                self._disk_bytes += disk_bytes
+            if entry.df is df:
+                entry.df = None
+                self._bytes -= entry.nbytes
+                self.spills += 1
+            while self._disk_bytes > self.max_disk_bytes:
+                oldest = next(key for key, e in self._entries.items() if e.path is not None and not e.shared)
+                self._evict(oldest)
+
+    def _ensure_spill_dir(self) -> str:
+        with self._lock:
+            if self._spill_dir is None:
+                if self._spill_root:
+                    os.makedirs(self._spill_root, exist_ok=True)
+                self._spill_dir = tempfile.mkdtemp(prefix="morph_datasets_", dir=self._spill_root)
+            return self._spill_dir
+
+    def _evict(self, dataset_id: str):
+        entry = self._entries.pop(dataset_id)
+        if entry.df is not None:
+            self._bytes -= entry.nbytes
+        if entry.shared:
+            try:
+                self.shared.release(dataset_id)
+            except sqlite3.Error as e:
+                print(f"Shared dataset release failed: {e}")
+        elif entry.path is not None:
+            self._disk_bytes -= entry.disk_bytes
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self.evictions += 1
+        if self._current.get(entry.owner) == dataset_id:
+            del self._current[entry.owner]
+
+    def close(self):
+        """Removes this process's spill files and drops its shared-store references."""
+        if self.shared is not None:
+            try:
+                self.shared.release_all()
+            except sqlite3.Error:
+                pass
+        with self._lock:
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+    def stats(self) -> dict:
+        shared = self.shared.stats() if self.shared is not None else None
+        with self._lock:
+            return {
+                "shared": shared,
+                "datasets": len(self._entries),
+                "resident": sum(1 for entry in self._entries.values() if entry.df is not None),
+                "spilled": sum(1 for entry in self._entries.values() if entry.df is None),
+                "owners": len({entry.owner for entry in self._entries.values()}),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+            }
+
+
+DATASETS = DatasetRegistry(
+    DATASET_BUDGET_MB * 1024 * 1024, MAX_DATASETS_PER_OWNER,
+    shared=SharedDatasetStore() if SHARED_DATASETS else None,
+)
+atexit.register(DATASETS.close)
+
+
+def register_dataset(df: pd.DataFrame, owner: str, make_current: bool = False) -> str:
+    """
+    Keeps a parsed frame on the server for `owner` and returns the ID clients
+    send back instead of re-posting every row.
+    Raises DatasetTooLarge when the frame alone exceeds the budget.
+    """
+    return DATASETS.register(owner, df, make_current)
+
+
+def get_dataset(dataset_id: str, owner: str, columns: list | None = None) -> pd.DataFrame:
+    """
+    Returns the owner's frame registered under dataset_id, marking it recently
+    used. `columns` lets a spilled dataset be read without loading every column.
+    """
+    return DATASETS.get(owner, dataset_id, columns)
+
+
+def current_dataset(owner: str) -> pd.DataFrame | None:
+    """The dataset most recently loaded through /api/upload by this owner, if still held."""
+    return DATASETS.current(owner)
+
+
+def frame_from_payload(data: dict, owner: str) -> pd.DataFrame:
+    """
+    Resolves the frame an analysis request refers to: a registered
+    dataset_id when given (with "version", one of its versions), otherwise
+    the legacy inline 'rows' list.
+    """
+    dataset_id = data.get("dataset_id")
+    if dataset_id and data.get("version") is not None:
+        from app.services.versions import version_frame
+
+        return version_frame(owner, dataset_id, data["version"])
+    if dataset_id:
+        return get_dataset(dataset_id, owner)
+    return pd.DataFrame(data.get("rows", []))
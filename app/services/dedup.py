@@ -0,0 +1,230 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Key for the 64-bit row hashes (hash_pandas_object takes 16-byte keys)
+PRIMARY_HASH_KEY = "0123456789123456"
+
+# id(frame) -> (weak reference to the frame, its RowFingerprints)
+_FINGERPRINTS = {}
+_FINGERPRINTS_LOCK = threading.Lock()
+
+
+def _mix(codes: np.ndarray, hash_key: str) -> np.ndarray:
+    """Spreads small integer codes over 64 bits (splitmix64 finalizer), seeded by the key."""
+    x = codes.astype(np.uint64) + np.uint64(int.from_bytes(hash_key.encode()[:8], "little"))
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _column_hashes(column: pd.Series, hash_key: str) -> np.ndarray:
+    if not pd.api.types.is_numeric_dtype(column.dtype):
+        # Within one frame, factorize codes identify text values as well as their
+        # hashes do, at a fraction of the cost (the codes mean nothing across frames)
+        codes, _ = pd.factorize(column)
+        return _mix(codes, hash_key)
+    values = column
+    if column.dtype.kind in "fc":
+        # -0.0 == 0.0 and every NaN is the same missing value, as in DataFrame.duplicated
+        values = column + 0.0
+        values = values.where(values.notna(), np.nan)
+    return pd.util.hash_pandas_object(values, index=False, hash_key=hash_key, categorize=True).to_numpy()
+
+
+def _row_hashes(df: pd.DataFrame, hash_key: str) -> np.ndarray:
+    """One 64-bit hash per row of this frame, combined column by column (order-sensitive)."""
+    out = np.full(len(df), 0x345678, dtype=np.uint64)
+    mult = np.uint64(1000003)
+    width = df.shape[1]
+    for j in range(width):
+        out ^= _column_hashes(df.iloc[:, j], hash_key)
+        out *= mult
+        mult += np.uint64(82520 + 2 * (width - j))
+    return out + np.uint64(97531)
+
+
+class RowFingerprints:
+    """
+    A 64-bit hash per row of a frame. Rows with equal hashes are duplicate
+    candidates, confirmed against the values before being dropped. The
+    verified duplicate mask is kept once computed, so later dedups and
+    counts on the same frame are free. Hashes are only comparable within
+    the frame (and its row subsets) they were built for. Picklable, so it
+    can travel with a frame to a worker process.
+
+    There is no chunk-by-chunk index: every dataset is whole in memory by
+    the time it is registered (ingest reads chunks into one frame), so rows
+    are only ever compared within one frame, and text columns can be hashed
+    by their factorize codes instead of their values.
+    """
+
+    __slots__ = ("hashes", "duplicated")
+
+    def __init__(self, hashes: np.ndarray):
+        self.hashes = hashes
+        self.duplicated = None
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "RowFingerprints":
+        return cls(_row_hashes(df, PRIMARY_HASH_KEY))
+
+    def take(self, positions: np.ndarray) -> "RowFingerprints":
+        """Fingerprints of a row subset (same columns), without rehashing."""
+        return RowFingerprints(self.hashes[positions])
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def row_fingerprints(df: pd.DataFrame) -> RowFingerprints:
+    """
+    The frame's fingerprints, built once and reused for as long as the frame
+    lives. Frames must not be modified after fingerprinting, the same
+    read-only contract registered datasets already have.
+    """
+    fingerprints = cached_fingerprints(df)
+    if fingerprints is not None:
+        return fingerprints
+    fingerprints = RowFingerprints.build(df)
+    remember_fingerprints(df, fingerprints)
+    return fingerprints
+
+
+def cached_fingerprints(df: pd.DataFrame) -> RowFingerprints | None:
+    """The frame's fingerprints if they were already built, without building them."""
+    with _FINGERPRINTS_LOCK:
+        hit = _FINGERPRINTS.get(id(df))
+    return hit[1] if hit is not None and hit[0]() is df else None
+
+
+def remember_fingerprints(df: pd.DataFrame, fingerprints: RowFingerprints):
+    """Caches fingerprints derived elsewhere (e.g. a row subset of a fingerprinted frame)."""
+    key = id(df)
+
+    def forget(_, key=key):
+        with _FINGERPRINTS_LOCK:
+            entry = _FINGERPRINTS.get(key)
+            if entry is not None and entry[0]() is None:
+                del _FINGERPRINTS[key]
+
+    with _FINGERPRINTS_LOCK:
+        _FINGERPRINTS[key] = (weakref.ref(df, forget), fingerprints)
+
+
+def _same_object(x, y) -> bool:
+    # Equality as pandas' object hashtable sees it: identity, ==, and NaN matching NaN
+    if x is y:
+        return True
+    if isinstance(x, float) and isinstance(y, float) and x != x and y != y:
+        return True
+    try:
+        return bool(x == y)
+    except (TypeError, ValueError):
+        return False
+
+
+_same_objects = np.frompyfunc(_same_object, 2, 1)
+
+
+def _rows_equal(df: pd.DataFrame, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Whether row left[i] equals row right[i] for every column. May answer
+    False for rows pandas considers equal (they are then re-checked exactly),
+    never True for rows it doesn't.
+    """
+    same = np.ones(len(left), dtype=bool)
+    for j in range(df.shape[1]):
+        if not same.any():
+            break
+        values = df.iloc[:, j].array
+        a, b = values.take(left), values.take(right)
+        if pd.api.types.is_object_dtype(values.dtype) and len(left) * 4 > len(values):
+            # Many pairs: compare factorize codes (the hashtable's own equality), and only
+            # pairs with a missing value object by object (None and NaN differ for pandas)
+            codes, _ = pd.factorize(values)
+            ca, cb = codes[left], codes[right]
+            eq = (ca == cb) & (ca >= 0)
+            both_missing = np.flatnonzero((ca < 0) & (cb < 0))
+            if len(both_missing):
+                eq[both_missing] = _same_objects(np.asarray(a)[both_missing], np.asarray(b)[both_missing]).astype(bool)
+        elif pd.api.types.is_object_dtype(values.dtype):
+            eq = _same_objects(np.asarray(a), np.asarray(b)).astype(bool)
+        else:
+            eq = a == b
+            eq = eq.to_numpy(dtype=bool, na_value=False) if not isinstance(eq, np.ndarray) else eq
+            eq = eq | (np.asarray(pd.isna(a)) & np.asarray(pd.isna(b)))
+        same &= eq
+    return same
+
+
+def duplicated_rows(df: pd.DataFrame, fingerprints: RowFingerprints | None = None) -> np.ndarray:
+    """
+    Boolean mask of rows that repeat an earlier row; the same answer as
+    df.duplicated(), computed from row fingerprints. Every hash match is
+    verified against the values, and hash groups that fail verification
+    are settled by pandas itself.
+    """
+    n = len(df)
+    if n == 0 or df.shape[1] == 0:
+        return df.duplicated().to_numpy()
+    if fingerprints is None:
+        fingerprints = row_fingerprints(df)
+    if fingerprints.duplicated is None:
+        fingerprints.duplicated = _verified_duplicates(df, fingerprints.hashes)
+    return fingerprints.duplicated
+
+
+def _verified_duplicates(df: pd.DataFrame, hashes: np.ndarray) -> np.ndarray:
+    n = len(df)
+    # factorize numbers hashes in order of first appearance, so a row is a
+    # hash's first occurrence exactly when its code is above every earlier code
+    codes, _ = pd.factorize(hashes)
+    is_first = np.empty(n, dtype=bool)
+    is_first[0] = True
+    is_first[1:] = codes[1:] > np.maximum.accumulate(codes)[:-1]
+    candidates = np.flatnonzero(~is_first)
+    dup = np.zeros(n, dtype=bool)
+    if not len(candidates):
+        return dup
+    first = np.flatnonzero(is_first)[codes[candidates]]
+    confirmed = _rows_equal(df, candidates, first)
+    dup[candidates[confirmed]] = True
+    unconfirmed = candidates[~confirmed]
+    if len(unconfirmed):
+        # A hash collision (or values the fast comparison can't judge): redo those groups exactly
+        group = np.flatnonzero(np.isin(codes, codes[unconfirmed]))
+        dup[group] = df.iloc[group].duplicated().to_numpy()
+    return dup
+
+
+def duplicate_index(df: pd.DataFrame) -> RowFingerprints:
+    """
+    The frame's fingerprints with the duplicate mask filled in. Built where
+    the frame is kept (the server process), so work sent to a worker process
+    reuses the mask instead of rebuilding it there and losing it.
+    """
+    fingerprints = row_fingerprints(df)
+    duplicated_rows(df, fingerprints)
+    return fingerprints
+
+
+def count_duplicate_rows(df: pd.DataFrame, fingerprints: RowFingerprints | None = None) -> int:
+    """Same count as df.duplicated().sum()."""
+    return int(duplicated_rows(df, fingerprints).sum())
+
+
+def filter_rows(df: pd.DataFrame, keep: np.ndarray, fingerprints: RowFingerprints) -> pd.DataFrame:
+    """df[keep], with the kept rows' fingerprints cached for the result."""
+    result = df[keep]
+    kept = fingerprints.take(np.flatnonzero(keep))
+    if fingerprints.duplicated is not None and not (fingerprints.duplicated & keep).any():
+        # Every repeat was filtered out, so the result has none
+        kept.duplicated = np.zeros(len(result), dtype=bool)
+    remember_fingerprints(result, kept)
+    return result
+
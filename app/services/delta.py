@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from app.services.serializer import json_fragments
+
+# Past this share of changed cells a delta saves little; the full rows are sent instead.
+DELTA_MAX_CHANGED_SHARE = 0.25
+
+
+def wants_delta(options: dict) -> bool:
+    """True when the request asked for a delta ({"delta": true}, or ?delta=1 with Arrow bodies)."""
+    return str(options.get("delta", "")).lower() in ("1", "true")
+
+
+def _runs(positions: np.ndarray) -> tuple:
+    """Sorted positions as (starts, lengths) of their consecutive runs."""
+    if not len(positions):
+        return positions, positions
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.r_[0, breaks]
+    lengths = np.diff(np.r_[starts, len(positions)])
+    return starts, lengths
+
+
+def frame_delta(original: pd.DataFrame, cleaned: pd.DataFrame, rows: np.ndarray, columns: list,
+                nan: str = '""', inf: str = "0") -> dict | None:
+    """
+    What a client holding `original` as row objects needs to turn it into
+    `cleaned`, whose rows and columns come from the `rows` and `columns`
+    positions of `original`:
+    - removed: [start, stop) runs of original row positions that are gone
+    - headers: the cleaned headers in order; renamed: {old header: new header}
+    - changes: {header: [[original row, [new values...]], ...]}, runs of
+      consecutive rows whose cell now reads differently in JSON
+    - missing: what missing cells read as (`nan`), so the client can apply
+      the same encoding to the cells it keeps.
+    Cells are compared as the JSON the full response would carry. Returns
+    None when so much changed that the full rows are about as small.
+    """
+    removed = np.ones(len(original), dtype=bool)
+    removed[rows] = False
+    gone = np.flatnonzero(removed)
+    starts, lengths = _runs(gone)
+    removed_runs = [[int(gone[s]), int(gone[s]) + int(n)] for s, n in zip(starts, lengths)]
+
+    headers = [str(c) for c in cleaned.columns]
+    renamed = {}
+    changes = {}
+    changed_cells = 0
+    budget = DELTA_MAX_CHANGED_SHARE * cleaned.size
+    for k, j in enumerate(columns):
+        source = str(original.columns[j])
+        if source != headers[k]:
+            renamed[source] = headers[k]
+        before = original.iloc[rows, j]
+        after = cleaned.iloc[:, k]
+        if before.dtype == after.dtype and before.array.equals(after.array):
+            continue
+        old, new = json_fragments(before, nan, inf), json_fragments(after, nan, inf)
+        diff = np.flatnonzero(old != new)
+        if not len(diff):
+            continue
+        changed_cells += len(diff)
+        if changed_cells > budget:
+            return None
+        at = rows[diff]
+        starts, lengths = _runs(at)
+        changes[headers[k]] = [
+            [int(at[s]), [json.loads(v) for v in new[diff[s:s + n]]]] for s, n in zip(starts, lengths)
+        ]
+
+    return {
+        "mode": "delta",
+        "base_rows": len(original),
+        "removed": removed_runs,
+        "headers": headers,
+        "renamed": renamed,
+        "changes": changes,
+        "missing": json.loads(nan),
+    }
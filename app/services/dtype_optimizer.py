@@ -0,0 +1,110 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+# Set MORPH_OPTIMIZE_DTYPES=0 to keep pandas' default dtypes at ingest.
+OPTIMIZE_DTYPES = os.environ.get("MORPH_OPTIMIZE_DTYPES", "1") != "0"
+# A text column becomes 'category' when at most this share of its values are distinct.
+CATEGORY_MAX_RATIO = 0.5
+
+_HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def _column_nbytes(series: pd.Series) -> int:
+    return int(series.memory_usage(index=False, deep=True))
+
+
+def _downcast_integer(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, downcast="integer")
+
+
+def widen_frame(df: pd.DataFrame | None) -> pd.DataFrame | None:
+    """
+    The frame with the integer columns _downcast_integer narrowed back at
+    int64, so sums and differences on them can't wrap; the frame itself when
+    it has none. Applied where datasets are handed to analysis code, so the
+    registered (stored) frames stay narrow.
+    """
+    if df is None:
+        return df
+    narrow = [j for j in range(df.shape[1]) if df.dtypes.iloc[j].kind in "iu" and df.dtypes.iloc[j].itemsize < 8]
+    if not narrow:
+        return df
+    df = df.copy(deep=False)
+    for j in narrow:
+        df.isetitem(j, df.iloc[:, j].astype(np.int64))
+    return df
+
+
+def _downcast_float(series: pd.Series) -> pd.Series:
+    """float64 -> float32 only when every value survives the round trip exactly."""
+    values = series.to_numpy()
+    narrow = values.astype(np.float32)
+    same = (narrow.astype(np.float64) == values) | (np.isnan(values) & np.isnan(narrow))
+    if same.all():
+        return pd.Series(narrow, index=series.index, name=series.name)
+    return series
+
+
+def _compact_text(series: pd.Series) -> pd.Series:
+    """Low-cardinality text -> category, otherwise Arrow-backed strings when pyarrow is present."""
+    if pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return series  # mixed or non-text object column; leave the values untouched
+    distinct = series.nunique(dropna=True)
+    if len(series) and distinct <= CATEGORY_MAX_RATIO * len(series):
+        return series.astype("category")
+    if _HAS_PYARROW and series.dtype == object:
+        return series.astype("string[pyarrow]")
+    return series
+
+
+def optimize_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
+    """
+    Shrinks a freshly parsed frame: integers are downcast to the smallest
+    type that holds them, float64 becomes float32 where that is lossless, and
+    text columns become category or Arrow strings. A column only changes if
+    the new representation is actually smaller.
+
+    Returns the frame and a memory report with per-column before/after bytes.
+    Narrow integers are a storage format; see widen_frame.
+    """
+    columns = []
+    data = {}
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        before = _column_nbytes(series)
+        candidate = series
+        try:
+            if pd.api.types.is_bool_dtype(series.dtype):
+                pass
+            elif pd.api.types.is_integer_dtype(series.dtype) and series.dtype.kind in "iu":
+                candidate = _downcast_integer(series)
+            elif series.dtype == np.float64:
+                candidate = _downcast_float(series)
+            elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+                candidate = _compact_text(series)
+        except (TypeError, ValueError):
+            candidate = series
+        after = _column_nbytes(candidate)
+        if after >= before:
+            candidate, after = series, before
+        data[i] = candidate
+        columns.append({
+            "column": str(df.columns[i]),
+            "dtype_before": str(series.dtype),
+            "dtype_after": str(candidate.dtype),
+            "bytes_before": before,
+            "bytes_after": after,
+        })
+
+    optimized = pd.DataFrame(data, copy=False)
+    optimized.columns = df.columns
+    optimized.index = df.index
+    report = {
+        "bytes_before": sum(c["bytes_before"] for c in columns),
+        "bytes_after": sum(c["bytes_after"] for c in columns),
+        "columns": columns,
+    }
+    return optimized, report
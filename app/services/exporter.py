@@ -0,0 +1,27 @@
+import pandas as pd
+
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def write_export(df: pd.DataFrame, file_format: str, path: str) -> str:
+    """
+    Writes the frame to `path` as a real Excel workbook ('xlsx'), an Arrow
+    IPC stream ('arrow') or CSV (anything else) and returns the format written.
+    """
+    if file_format == "xlsx":
+        # Use ExcelWriter to create a real Excel file
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False, sheet_name="Cleaned Data")
+        return "xlsx"
+    if file_format == "arrow":
+        from app.services.arrow_transport import frame_to_arrow_bytes
+
+        with open(path, "wb") as f:
+            f.write(frame_to_arrow_bytes(df))
+        return "arrow"
+    df.to_csv(path, index=False)
+    return "csv"
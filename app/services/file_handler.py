@@ -1,7 +1,10 @@
+import asyncio
 import pandas as pd
 from fastapi import UploadFile
 from io import BytesIO
-DATAFRAME: pd.DataFrame | None = None
+from app.services.ingest import read_excel_sheet
+from app.services.dtype_optimizer import optimize_frame, widen_frame, OPTIMIZE_DTYPES
+from app.services.dataset_store import register_dataset, current_dataset, DatasetTooLarge
 
 def calculate_all_metrics(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -54,41 +57,51 @@ def calculate_all_metrics(df: pd.DataFrame) -> pd.DataFrame:
     print("Metrics calculation complete.")
     return df
 
-async def save_file(file: UploadFile):
+async def save_file(file: UploadFile, owner: str):
     """
-    Reads an uploaded CSV/Excel file into a global pandas DataFrame
-    and then calculates all derived metrics.
+    Reads an uploaded CSV/Excel file into a pandas DataFrame, calculates all
+    derived metrics and registers it as the owner's current dataset.
+    Raises DatasetTooLarge when the frame doesn't fit the dataset budget.
     """
-    global DATAFRAME
-    
     filename = file.filename
     content = await file.read()
     
     try:
         if filename.endswith(".csv"):
-            DATAFRAME = pd.read_csv(BytesIO(content))
+            df = pd.read_csv(BytesIO(content))
         elif filename.endswith((".xls", ".xlsx")):
-            DATAFRAME = pd.read_excel(BytesIO(content))
+            df = read_excel_sheet(BytesIO(content), filename)
         else:
             return {"success": False, "message": "Unsupported file format"}
 
         # <<< --- YAHAN PAR HUMNE METRICS CALCULATION KO CALL KIYA HAI --- >>>
-        DATAFRAME = calculate_all_metrics(DATAFRAME)
+        df = calculate_all_metrics(df)
+
+        # Shrink dtypes after the metric arithmetic so downcast integers can't overflow there
+        memory = None
+        if OPTIMIZE_DTYPES:
+            df, memory = optimize_frame(df)
+
+        dataset_id = await asyncio.to_thread(register_dataset, df, owner, make_current=True)
 
         return {
             "success": True,
             "filename": filename,
             "size": len(content),
+            "dataset_id": dataset_id,
+            "memory": memory,
         }
+    except DatasetTooLarge:
+        raise
     except Exception as e:
-        DATAFRAME = None
         return {"success": False, "message": f"Error parsing file: {str(e)}"}
 
-def get_dataframe() -> pd.DataFrame | None:
+def get_dataframe(owner: str) -> pd.DataFrame | None:
     """
-    Returns the currently loaded DataFrame.
+    Returns the DataFrame this owner last loaded through /api/upload, with
+    downcast integers widened for arithmetic (see widen_frame).
     """
-    return DATAFRAME
+    return widen_frame(current_dataset(owner))
 
 import io
 
@@ -107,8 +120,8 @@ def process_uploaded_file(file_content: bytes, filename: str):
             df = pd.read_csv(io.BytesIO(file_content))
             
         elif filename.endswith(('.xls', '.xlsx')):
-            # Requires 'openpyxl' library installed
-            df = pd.read_excel(io.BytesIO(file_content))
+            # Requires 'openpyxl' library installed (streams .xlsx rows in read-only mode)
+            df = read_excel_sheet(io.BytesIO(file_content), filename)
             
         elif filename.endswith('.json'):
             df = pd.read_json(io.BytesIO(file_content))
@@ -0,0 +1,547 @@
+import codecs
+import csv
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import asynccontextmanager
+
+import numpy as np
+import pandas as pd
+from fastapi import UploadFile
+
+# Size of each read from the incoming upload stream.
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Rows per chunk when parsing CSV bodies incrementally.
+CSV_CHUNK_ROWS = 100_000
+# Columnar and line-delimited formats accepted by the upload endpoint.
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+# Rows per chunk when streaming .xlsx sheets.
+EXCEL_CHUNK_ROWS = 50_000
+# How much of a CSV the sniffer looks at to pick the dialect and header row.
+SNIFF_BYTES = 64 * 1024
+SNIFF_MAX_ROWS = 50
+SNIFF_DELIMITERS = ",;\t|"
+# Cell values pandas reads as missing; they don't count towards a header row.
+_NA_TOKENS = {"", "na", "n/a", "nan", "null", "none", "#n/a", "-nan", "1.#ind", "-1.#ind", "1.#qnan", "<na>"}
+# How much of a file the encoding detector inspects.
+ENCODING_SAMPLE_BYTES = 256 * 1024
+# Codec error handler for UTF-8 files with the odd stray legacy byte further
+# down than the detector looked: the byte is read as Latin-1 instead of failing
+# the whole parse, so every file is decoded exactly once.
+LATIN1_FALLBACK = "morph-latin1-fallback"
+codecs.register_error(
+    LATIN1_FALLBACK,
+    lambda err: (err.object[err.start:err.end].decode("latin-1"), err.end),
+)
+_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+# Where uploads are spooled while they are parsed (defaults to the system temp dir).
+SPOOL_DIR = os.environ.get("MORPH_SPOOL_DIR") or None
+
+
+class IngestError(ValueError):
+    """A problem with the uploaded file or parse options that the user can fix."""
+
+
+class SpooledUpload:
+    """An upload copied to local disk, with its size and content digest."""
+
+    def __init__(self, path: str, size: int, digest: str):
+        self.path = path
+        self.size = size
+        self.digest = digest
+
+
+@asynccontextmanager
+async def spooled_upload(file: UploadFile):
+    """
+    Copies an upload to a temp file in fixed-size chunks and yields a
+    SpooledUpload. The upload is never held in memory as one bytes object;
+    the content digest is computed on the same pass, and the temp file is
+    removed when the block exits.
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="morph_upload_", suffix=suffix, dir=SPOOL_DIR)
+    hasher = hashlib.blake2b(digest_size=20)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        yield SpooledUpload(path, size, hasher.hexdigest())
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class FrameBuilder:
+    """
+    Assembles a DataFrame from parsed chunks column by column.
+
+    Each chunk is split into standalone column arrays as soon as it arrives so
+    the chunk itself can be freed; build() then joins one column at a time,
+    which keeps peak memory close to the size of the final frame instead of
+    "all chunks + concatenated copy".
+    """
+
+    def __init__(self):
+        self.columns = None
+        self._parts = []
+        self.rows = 0
+
+    def append(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            self._parts = [[] for _ in self.columns]
+        for i in range(len(self.columns)):
+            # A deep copy detaches the column from the chunk's 2D block
+            self._parts[i].append(chunk.iloc[:, i].copy(deep=True))
+        self.rows += len(chunk)
+
+    def widen(self, new_columns: list):
+        """Adds columns that only show up in later chunks; earlier rows get NaN."""
+        if self.columns is None:
+            self.columns, self._parts = [], []
+        for col in new_columns:
+            self.columns.append(col)
+            self._parts.append([pd.Series(np.nan, index=range(self.rows))] if self.rows else [])
+
+    def build(self) -> pd.DataFrame:
+        if self.columns is None:
+            return pd.DataFrame()
+        data = {}
+        for i, col in enumerate(self.columns):
+            parts = self._parts[i]
+            if not parts:
+                joined = pd.Series([], dtype=object)
+            else:
+                joined = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+            data[col] = joined.array
+            # Release this column's pieces before joining the next one
+            self._parts[i] = None
+        df = pd.DataFrame(data, columns=self.columns, copy=False)
+        self.columns, self._parts = None, []
+        return df
+
+
+def read_csv_chunked(path: str, chunk_rows: int = CSV_CHUNK_ROWS, progress=None, **kwargs) -> pd.DataFrame:
+    """
+    Parses a CSV file in row chunks and feeds them to a FrameBuilder.
+    Extra keyword arguments are passed straight to pd.read_csv.
+    `progress`, when given, is called with rows_parsed and bytes_read after each chunk.
+    """
+    builder = FrameBuilder()
+    rows = 0
+    with open(path, "rb") as f, pd.read_csv(f, chunksize=chunk_rows, **kwargs) as reader:
+        for chunk in reader:
+            builder.append(chunk)
+            rows += len(chunk)
+            if progress is not None:
+                progress(rows_parsed=rows, bytes_read=f.tell())
+    if builder.columns is None:
+        # Header-only file: no chunks were produced, keep the column names
+        return pd.read_csv(path, nrows=0, **kwargs)
+    return builder.build()
+
+
+def detect_encoding(path: str, sample_bytes: int = ENCODING_SAMPLE_BYTES) -> dict:
+    """
+    Picks the codec for a text upload from a bounded prefix.
+    Order: byte-order mark, strict UTF-8 check, then a statistical guess
+    (charset_normalizer when installed, otherwise cp1252/Latin-1).
+    Returns {"encoding", "method", "errors"}; "errors" is the codec error
+    handler to decode the rest of the file with.
+    """
+    with open(path, "rb") as fh:
+        raw = fh.read(sample_bytes)
+        at_eof = not fh.read(1)
+
+    for bom, name in _BOMS:
+        if raw.startswith(bom):
+            return {"encoding": name, "method": "bom", "errors": "replace"}
+
+    try:
+        # Incremental decode so a character cut off at the sample edge is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(raw, final=at_eof)
+        return {"encoding": "utf-8", "method": "utf8-valid", "errors": LATIN1_FALLBACK}
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(raw).best()
+        if best is not None and best.encoding:
+            return {"encoding": codecs.lookup(best.encoding).name, "method": "statistical", "errors": "replace"}
+    except ImportError:
+        pass
+
+    # Windows-1252 is a superset of Latin-1 for printable text; fall back to
+    # Latin-1 only when the sample uses bytes cp1252 leaves undefined.
+    try:
+        raw.decode("cp1252")
+        return {"encoding": "cp1252", "method": "statistical", "errors": "replace"}
+    except UnicodeDecodeError:
+        return {"encoding": "iso-8859-1", "method": "statistical", "errors": "strict"}
+
+
+def _quotes_delimiter(sample: str, quotechar: str, delimiter: str) -> bool:
+    """Whether some field in the sample is `quotechar`-quoted and contains the delimiter."""
+    q, d = re.escape(quotechar), re.escape(delimiter)
+    pattern = rf"(?:^|{d})[ ]*{q}[^{q}\n]*{d}[^{q}\n]*{q}[ ]*(?:{d}|\r?$)"
+    return re.search(pattern, sample, re.MULTILINE) is not None
+
+
+def sniff_csv(path: str, encoding: str = "utf-8", errors: str = "strict", sample_bytes: int = SNIFF_BYTES, max_rows: int = SNIFF_MAX_ROWS) -> dict:
+    """
+    Looks at a bounded prefix of a CSV file and picks the delimiter, quote
+    character and header row, so the body only has to be parsed once.
+
+    The header row is the first of the leading rows with the most non-empty
+    cells. It is returned as a count of physical lines to skip, which
+    read_csv accepts regardless of blank-line handling.
+    """
+    with open(path, "rb") as fh:
+        raw = fh.read(sample_bytes)
+        at_eof = not fh.read(1)
+    sample = codecs.getincrementaldecoder(encoding)(errors).decode(raw, final=at_eof)
+    if not at_eof:
+        # Drop the trailing partial line
+        cut = sample.rfind("\n")
+        if cut != -1:
+            sample = sample[:cut + 1]
+    if sample.startswith("\ufeff"):
+        sample = sample[1:]
+
+    delimiter, quotechar = ",", '"'
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=SNIFF_DELIMITERS)
+        delimiter = dialect.delimiter
+        # The sniffer reads apostrophes in ordinary text as quotes ('y' or O'Brien),
+        # so another quote character is only taken when it encloses a delimiter
+        if dialect.quotechar and dialect.quotechar != quotechar and _quotes_delimiter(sample, dialect.quotechar, delimiter):
+            quotechar = dialect.quotechar
+    except csv.Error:
+        pass
+
+    reader = csv.reader(io.StringIO(sample), delimiter=delimiter, quotechar=quotechar)
+    best_count, skiprows = 0, 0
+    lines_before = 0
+    scored = 0
+    try:
+        for row in reader:
+            if scored >= max_rows:
+                break
+            start_line = lines_before
+            lines_before = reader.line_num
+            if not row or (len(row) == 1 and not row[0].strip()):
+                continue  # blank line, read_csv skips these too
+            scored += 1
+            count = sum(1 for cell in row if cell.strip().lower() not in _NA_TOKENS)
+            if count > best_count:
+                best_count, skiprows = count, start_line
+    except csv.Error:
+        pass
+
+    return {
+        "delimiter": delimiter,
+        "quotechar": quotechar,
+        "skiprows": skiprows,
+    }
+
+
+def csv_read_options(dialect: dict, encoding: dict) -> dict:
+    """Turns sniff_csv and detect_encoding results into pd.read_csv keyword arguments."""
+    return {
+        "encoding": encoding["encoding"],
+        "encoding_errors": encoding["errors"],
+        "sep": dialect["delimiter"],
+        "quotechar": dialect["quotechar"],
+        "skiprows": dialect["skiprows"],
+        "header": 0,
+    }
+
+
+# --- Excel ---
+
+def _has_calamine() -> bool:
+    return importlib.util.find_spec("python_calamine") is not None
+
+
+def _is_xlsx(filename: str) -> bool:
+    return filename.lower().endswith((".xlsx", ".xlsm"))
+
+
+def _xlsx_workbook_part(zf: zipfile.ZipFile) -> str:
+    """Finds the workbook part via the package relationships (nearly always xl/workbook.xml)."""
+    try:
+        with zf.open("_rels/.rels") as fh:
+            for rel in ET.parse(fh).getroot():
+                if rel.get("Type", "").endswith("/officeDocument"):
+                    return rel.get("Target").lstrip("/")
+    except KeyError:
+        pass
+    return "xl/workbook.xml"
+
+
+def list_excel_sheets(source, filename: str) -> list:
+    """
+    Returns the sheet names of a workbook. For .xlsx this reads only the
+    workbook metadata part of the zip; no worksheet or cell data is touched.
+    """
+    if _is_xlsx(filename):
+        try:
+            with zipfile.ZipFile(source) as zf:
+                with zf.open(_xlsx_workbook_part(zf)) as fh:
+                    return [
+                        elem.get("name")
+                        for _, elem in ET.iterparse(fh)
+                        if elem.tag.rsplit("}", 1)[-1] == "sheet"
+                    ]
+        except (KeyError, zipfile.BadZipFile, ET.ParseError):
+            if hasattr(source, "seek"):
+                source.seek(0)
+    with pd.ExcelFile(source) as xls:
+        return xls.sheet_names
+
+
+def _excel_header(values) -> list:
+    """Names header cells the way pd.read_excel does: blanks -> 'Unnamed: i', repeats -> 'name.1'."""
+    names, seen = [], {}
+    for i, val in enumerate(values):
+        name = f"Unnamed: {i}" if val is None or (isinstance(val, str) and not val.strip()) else val
+        if name in seen:
+            seen[name] += 1
+            mangled = f"{name}.{seen[name]}"
+            while mangled in seen:
+                seen[name] += 1
+                mangled = f"{name}.{seen[name]}"
+            seen[mangled] = 0
+            name = mangled
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _coerce_numeric_text(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts object columns holding numbers and numeric text to numbers, as
+    pd.read_excel does. Booleans and dates are left alone.
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype):
+            continue
+        if series.dtype == object and series.hasnans:
+            # read_excel reports missing cells in object columns as NaN, not None
+            series = df[col] = series.where(series.notna(), np.nan)
+        kind = pd.api.types.infer_dtype(series, skipna=True)
+        if kind not in ("string", "empty", "integer", "floating", "mixed-integer", "mixed-integer-float", "mixed"):
+            continue
+        try:
+            df[col] = pd.to_numeric(series)
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def _read_xlsx_streaming(source, sheet, chunk_rows: int, progress=None) -> pd.DataFrame:
+    """
+    Streams one .xlsx sheet through openpyxl's read-only mode. Rows arrive as
+    plain value tuples (no Cell objects) and are fed to a FrameBuilder in chunks.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[sheet] if isinstance(sheet, str) else wb.worksheets[sheet]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        columns = _excel_header(header)
+
+        builder = FrameBuilder()
+        builder.widen(columns)
+        batch, pending_blank = [], []
+
+        def flush():
+            if batch:
+                chunk = pd.DataFrame(batch, columns=builder.columns, dtype=object).infer_objects()
+                builder.append(chunk)
+                batch.clear()
+                if progress is not None:
+                    progress(rows_parsed=builder.rows)
+
+        for row in rows:
+            if all(v is None for v in row):
+                # Trailing blank rows are dropped, interior ones kept (as read_excel does)
+                pending_blank.append(row)
+                continue
+            if len(row) > len(builder.columns):
+                flush()
+                width = len(builder.columns)
+                builder.widen([f"Unnamed: {i}" for i in range(width, len(row))])
+            for blank in pending_blank + [row]:
+                batch.append(tuple(blank) + (None,) * (len(builder.columns) - len(blank)))
+            pending_blank = []
+            if len(batch) >= chunk_rows:
+                flush()
+        flush()
+        return _coerce_numeric_text(builder.build())
+    finally:
+        wb.close()
+
+
+def read_excel_sheet(source, filename: str, sheet=0, chunk_rows: int = EXCEL_CHUNK_ROWS, progress=None) -> pd.DataFrame:
+    """
+    Parses one sheet of a workbook (path or file object).
+    .xlsx uses the calamine engine when python-calamine is installed and
+    otherwise streams rows through openpyxl read-only mode; .xls goes
+    through pandas' default reader.
+    """
+    if _is_xlsx(filename):
+        if _has_calamine():
+            return pd.read_excel(source, sheet_name=sheet, engine="calamine")
+        return _read_xlsx_streaming(source, sheet, chunk_rows, progress)
+    return pd.read_excel(source, sheet_name=sheet)
+
+
+# --- Parquet / Arrow IPC / NDJSON ---
+
+def parse_columns_option(columns: str | None) -> list | None:
+    """Splits a comma-separated column projection; None or blank means all columns."""
+    if not columns:
+        return None
+    wanted = [c.strip() for c in columns.split(",") if c.strip()]
+    return wanted or None
+
+
+def _check_projection(available: list, columns: list | None):
+    if columns is None:
+        return
+    missing = [c for c in columns if c not in available]
+    if missing:
+        raise IngestError(f"Unknown columns: {', '.join(missing)}")
+
+
+def read_parquet_file(path: str, columns: list | None = None) -> pd.DataFrame:
+    """
+    Reads a Parquet file, decoding only the projected columns. The file is
+    memory-mapped so column chunks that aren't selected are never read.
+    """
+    import pyarrow.parquet as pq
+
+    _check_projection(pq.read_schema(path).names, columns)
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def read_arrow_file(path: str, columns: list | None = None) -> pd.DataFrame:
+    """
+    Reads an Arrow IPC file (Feather v2) or stream. The file is
+    memory-mapped and projected before conversion, so only the selected
+    columns' pages are touched and to_pandas makes the single copy into
+    pandas-owned memory (the spooled file can then be removed on any OS).
+    """
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    with pa.memory_map(path, "r") as source:
+        try:
+            table = ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            # Not the random-access file format; try the streaming format
+            source.seek(0)
+            table = ipc.open_stream(source).read_all()
+        _check_projection(table.column_names, columns)
+        if columns is not None:
+            table = table.select(columns)
+        df = table.to_pandas()
+        del table
+    return df
+
+
+def read_ndjson_file(path: str, encoding: dict, columns: list | None = None,
+                     chunk_rows: int = CSV_CHUNK_ROWS, progress=None) -> pd.DataFrame:
+    """Parses line-delimited JSON in chunks, keeping only the projected columns."""
+    builder = FrameBuilder()
+    with pd.read_json(path, lines=True, chunksize=chunk_rows, encoding=encoding["encoding"],
+                      encoding_errors=encoding["errors"], dtype=False) as reader:
+        for chunk in reader:
+            if columns is not None:
+                _check_projection(list(chunk.columns), columns)
+                chunk = chunk[columns]
+            if builder.columns is not None and list(chunk.columns) != builder.columns:
+                # Records may introduce keys later in the file
+                new = [c for c in chunk.columns if c not in builder.columns]
+                builder.widen(new)
+                chunk = chunk.reindex(columns=builder.columns)
+            builder.append(chunk)
+            if progress is not None:
+                progress(rows_parsed=builder.rows)
+    return builder.build()
+
+
+def parse_upload(path: str, filename: str, sheet=None, columns: list | None = None, progress=None) -> tuple:
+    """
+    Parses a spooled upload by extension, drops columns that are entirely
+    empty and shrinks its dtypes. Self-contained so it can run in a worker
+    process; returns (df, encoding, memory report). `progress` is passed to
+    the chunked readers.
+    """
+    from app.services.dtype_optimizer import optimize_frame, OPTIMIZE_DTYPES
+
+    name = filename.lower()
+    encoding = None
+    if name.endswith((".xlsx", ".xls")):
+        df = read_excel_sheet(path, filename, sheet=0 if sheet is None else sheet, progress=progress)
+        if columns:
+            _check_projection(list(df.columns), columns)
+            df = df[columns]
+    elif name.endswith(PARQUET_EXTENSIONS):
+        df = read_parquet_file(path, columns=columns)
+    elif name.endswith(ARROW_EXTENSIONS):
+        df = read_arrow_file(path, columns=columns)
+    elif name.endswith(NDJSON_EXTENSIONS):
+        encoding = detect_encoding(path)
+        df = read_ndjson_file(path, encoding, columns=columns, progress=progress)
+    else:
+        # Detect the codec and dialect from a bounded prefix, then decode and parse the body once
+        encoding = detect_encoding(path)
+        dialect = sniff_csv(path, encoding=encoding["encoding"], errors=encoding["errors"])
+        options = csv_read_options(dialect, encoding)
+        if columns:
+            _check_projection(list(pd.read_csv(path, nrows=0, **options).columns), columns)
+            # Only the projected columns are converted and kept
+            options["usecols"] = columns
+        df = read_csv_chunked(path, progress=progress, **options)
+        if columns:
+            df = df[columns]
+
+    # Remove columns that are 100% empty (safe cleanup)
+    df = df.dropna(axis=1, how='all')
+
+    memory = None
+    if OPTIMIZE_DTYPES:
+        df, memory = optimize_frame(df)
+    return df, encoding, memory
@@ -0,0 +1,378 @@
+import asyncio
+import functools
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+# Job inputs, outputs and the state database live here; it must survive restarts.
+JOBS_DIR = os.environ.get("MORPH_JOBS_DIR", "morph_jobs")
+JOBS_DB = os.environ.get("MORPH_JOBS_DB") or os.path.join(JOBS_DIR, "jobs.sqlite3")
+# Jobs one server process runs at the same time.
+JOB_CONCURRENCY = int(os.environ.get("MORPH_JOB_CONCURRENCY", "2"))
+# A running job whose worker hasn't checked in for this long is picked up by another.
+JOB_STALE_SECONDS = int(os.environ.get("MORPH_JOB_STALE_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.environ.get("MORPH_JOB_POLL_SECONDS", "1"))
+# Finished jobs and their files are deleted after this many hours.
+JOB_TTL_HOURS = float(os.environ.get("MORPH_JOB_TTL_HOURS", "24"))
+# A job that keeps taking its worker down is failed after this many starts.
+JOB_MAX_ATTEMPTS = 3
+
+# Store calls made from the event loop run on this one thread, so writes land in the order made.
+_STORE_THREAD = ThreadPoolExecutor(max_workers=1, thread_name_prefix="morph-job-store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    state TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    params TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    error_status INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at);
+"""
+
+
+class JobNotFound(KeyError):
+    """Raised when a job ID is unknown, purged, or belongs to another owner."""
+
+
+class JobError(Exception):
+    """A job failure caused by its input; `status_code` is what the result endpoint returns."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def in_store_thread(func, *args, **kwargs):
+    """Runs a blocking JobStore call on the store thread, off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_STORE_THREAD, functools.partial(func, *args, **kwargs))
+
+
+class JobStore:
+    """
+    Job state in a local SQLite file. Every call opens its own connection, so
+    the store can be used from threads and worker processes; async code
+    calls it through in_store_thread. States: queued -> running -> done | failed.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB, jobs_dir: str = JOBS_DIR):
+        self.db_path = db_path
+        self.jobs_dir = jobs_dir
+        self.result_datasets = {}  # job_id -> dataset_id of its result registered in this process
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.close()
+            self._ready = True
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _db(self):
+        return closing(self._connect())
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def new_job(self) -> str:
+        """Reserves a job ID and its directory; inputs are staged there before submit()."""
+        self._connect().close()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        return job_id
+
+    def submit(self, job_id: str, kind: str, owner: str, params: dict):
+        now = time.time()
+        with self._db() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, state, stage, params, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 'queued', ?, ?, ?)",
+                (job_id, kind, owner, json.dumps(params), now, now),
+            )
+
+    def get(self, job_id: str, owner: str | None = None) -> dict:
+        with self._db() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (owner is not None and row["owner"] != owner):
+            raise JobNotFound(job_id)
+        job = dict(row)
+        for field in ("progress", "params", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def claim(self, worker: str, stale_seconds: float = JOB_STALE_SECONDS) -> dict | None:
+        """
+        Atomically takes the oldest queued job, or a running one whose worker
+        stopped sending heartbeats (e.g. the server restarted mid-job).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE state = 'queued' "
+                "OR (state = 'running' AND heartbeat_at < ?) ORDER BY created_at LIMIT 1",
+                (now - stale_seconds,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', stage = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                    ("Job was interrupted too many times.", now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                return self.claim(worker, stale_seconds)
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, "
+                "heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (worker, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    def heartbeat(self, job_id: str, worker: str):
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), job_id, worker),
+            )
+
+    def update_progress(self, job_id: str, stage: str | None = None, **fields):
+        """Sets the stage and merges `fields` into the job's progress counters."""
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = COALESCE(?, stage), progress = json_patch(progress, ?), "
+                "updated_at = ? WHERE id = ?",
+                (stage, json.dumps(fields), time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, result: dict):
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'done', stage = 'done', result = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(result, default=str), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str, status_code: int = 500):
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', stage = 'failed', error = ?, error_status = ?, "
+                "updated_at = ? WHERE id = ?",
+                (error, status_code, time.time(), job_id),
+            )
+
+    def release(self, worker: str):
+        """Puts a stopping worker's running jobs back in the queue for the next start."""
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = attempts - 1, updated_at = ? "
+                "WHERE worker = ? AND state = 'running'",
+                (time.time(), worker),
+            )
+
+    def purge(self, older_than_seconds: float) -> int:
+        """
+        Deletes finished jobs (and their files) last updated before the cutoff,
+        and forgets result datasets of jobs that are gone (possibly purged by
+        another server process).
+        """
+        cutoff = time.time() - older_than_seconds
+        with self._db() as conn:
+            ids = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE state IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+            )]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+            known = list(self.result_datasets)
+            live = set()
+            for start in range(0, len(known), 500):
+                batch = known[start:start + 500]
+                live.update(row["id"] for row in conn.execute(
+                    f"SELECT id FROM jobs WHERE id IN ({','.join('?' * len(batch))})", batch))
+        for job_id in known:
+            if job_id not in live:
+                self.result_datasets.pop(job_id, None)
+        for job_id in ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(ids)
+
+    def counts(self) -> dict:
+        with self._db() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+
+class JobProgress:
+    """
+    Picklable progress callback for one job; it can be handed to a worker
+    process. Counter updates are throttled, stage changes are written at once.
+    Called on the event loop, the write is queued on the store thread instead.
+    """
+
+    def __init__(self, db_path: str, jobs_dir: str, job_id: str, min_interval: float = 0.5):
+        self.db_path = db_path
+        self.jobs_dir = jobs_dir
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self._last = 0.0
+
+    def __call__(self, stage: str | None = None, **fields):
+        now = time.monotonic()
+        if stage is None and now - self._last < self.min_interval:
+            return
+        self._last = now
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(stage, fields)  # a worker process or thread
+        else:
+            _STORE_THREAD.submit(self._write, stage, fields)
+
+    def _write(self, stage: str | None, fields: dict):
+        try:
+            JobStore(self.db_path, self.jobs_dir).update_progress(self.job_id, stage, **fields)
+        except sqlite3.Error as e:
+            print(f"Job progress update failed: {e}")
+
+
+# kind -> async handler(job, progress) returning the job's result dict
+JOB_HANDLERS = {}
+
+
+def job_handler(kind: str):
+    """Registers the coroutine that runs jobs of this kind."""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+class JobRunner:
+    """
+    Claims jobs from the store and runs them on this server's event loop,
+    up to `concurrency` at a time. Heavy work inside handlers goes through
+    offload.run_cpu, so the loop stays responsive.
+    """
+
+    def __init__(self, store: JobStore, concurrency: int = JOB_CONCURRENCY, poll_seconds: float = JOB_POLL_SECONDS):
+        self.store = store
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task = None
+        self._wake = None
+        self._running = set()
+
+    async def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            for task in list(self._running):
+                task.cancel()
+            self._task = None
+            await in_store_thread(self.store.release, self.worker)
+
+    def wake(self):
+        """Checks for new jobs now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _loop(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        last_purge = 0.0
+        while True:
+            await slots.acquire()
+            # Any error here is logged and retried at the next poll: if the loop ended,
+            # queued jobs would never run
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.worker)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is not None:
+                try:
+                    task = asyncio.create_task(self._run(job, slots))
+                except Exception as e:
+                    print(f"Job {job['id']} dispatch failed: {e}")
+                    slots.release()
+                else:
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                    continue
+            else:
+                slots.release()
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.store.purge, JOB_TTL_HOURS * 3600)
+                except Exception as e:
+                    print(f"Job purge failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_STALE_SECONDS / 3)
+            await asyncio.to_thread(self.store.heartbeat, job_id, self.worker)
+
+    async def _run(self, job: dict, slots: asyncio.Semaphore):
+        beat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            handler = JOB_HANDLERS.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            progress = JobProgress(self.store.db_path, self.store.jobs_dir, job["id"])
+            result = await handler(job, progress)
+            # After any progress writes still queued on the store thread
+            await in_store_thread(self.store.finish, job["id"], result)
+        except asyncio.CancelledError:
+            raise  # server shutting down; another start picks the job up again
+        except JobError as e:
+            await in_store_thread(self.store.fail, job["id"], str(e), e.status_code)
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            await in_store_thread(self.store.fail, job["id"], str(e))
+        finally:
+            beat.cancel()
+            slots.release()
+
+
+JOBS = JobStore()
+JOB_RUNNER = JobRunner(JOBS)
@@ -0,0 +1,188 @@
+import asyncio
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+# Worker processes for CPU-bound pandas work; 0 runs it on a thread in this process instead.
+WORKER_PROCESSES = int(os.environ.get("MORPH_WORKER_PROCESSES") or os.cpu_count() or 1)
+# Each worker is replaced after this many tasks, returning whatever memory pandas held on to.
+WORKER_MAX_TASKS = int(os.environ.get("MORPH_WORKER_MAX_TASKS", "50"))
+# Work on less data than this (bytes) runs on a thread; the process hop would cost more.
+OFFLOAD_MIN_BYTES = int(os.environ.get("MORPH_OFFLOAD_MIN_BYTES", str(4 * 1024 * 1024)))
+# Where frames are staged for workers (defaults to the system temp dir).
+FRAME_DIR = os.environ.get("MORPH_WORKER_FRAME_DIR") or None
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class FrameRef:
+    """
+    A DataFrame staged in a file (see save_frame); this is what crosses the
+    process boundary. Callers may pass refs to files they own to run_cpu;
+    only `temporary` refs are deleted after use.
+    """
+
+    def __init__(self, path: str, temporary: bool = False):
+        self.path = path
+        self.temporary = temporary
+
+
+def save_frame(df: pd.DataFrame, path: str):
+    """
+    Writes a frame as an Arrow IPC file that can be memory-mapped back.
+    Frames Arrow can't represent (mixed object columns, non-text column names)
+    are pickled to the file instead.
+    """
+    import pyarrow as pa
+
+    if all(isinstance(c, str) for c in df.columns) and df.columns.is_unique:
+        try:
+            table = pa.Table.from_pandas(df)
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            return
+        except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    with open(path, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def dump_frame(df: pd.DataFrame) -> FrameRef:
+    """Stages a frame in a temp file (see save_frame)."""
+    fd, path = tempfile.mkstemp(prefix="morph_frame_", dir=FRAME_DIR)
+    os.close(fd)
+    try:
+        save_frame(df, path)
+        return FrameRef(path, temporary=True)
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def load_frame(ref: FrameRef, remove: bool = False) -> pd.DataFrame:
+    """Opens a staged frame (memory-mapped when it is Arrow); `remove` deletes the file afterwards."""
+    import pyarrow as pa
+
+    try:
+        try:
+            with pa.memory_map(ref.path) as source:
+                return pa.ipc.open_file(source).read_all().to_pandas()
+        except pa.ArrowInvalid:
+            with open(ref.path, "rb") as f:
+                return pickle.load(f)
+    finally:
+        if remove:
+            os.remove(ref.path)
+
+
+def _stage(value):
+    """Replaces frames in a value (or a tuple/list of values) with FrameRefs."""
+    if isinstance(value, pd.DataFrame):
+        return dump_frame(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_stage(v) for v in value)
+    return value
+
+
+def _unstage(value, remove: bool):
+    if isinstance(value, FrameRef):
+        return load_frame(value, remove=remove)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_unstage(v, remove) for v in value)
+    return value
+
+
+def _discard(value):
+    """Deletes the temporary staged files left in a value."""
+    if isinstance(value, FrameRef) and value.temporary:
+        try:
+            os.remove(value.path)
+        except OSError:
+            pass
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _discard(v)
+
+
+def _run_in_worker(func, args, kwargs):
+    """Worker-side entry point: load staged inputs, run, stage frame results."""
+    args = _unstage(args, remove=False)
+    kwargs = {key: _unstage(value, remove=False) for key, value in kwargs.items()}
+    return _stage(func(*args, **kwargs))
+
+
+def _call_local(func, args, kwargs):
+    args = _unstage(args, remove=False)
+    kwargs = {key: _unstage(value, remove=False) for key, value in kwargs.items()}
+    return func(*args, **kwargs)
+
+
+def _payload_bytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=False, deep=False).sum())
+    if isinstance(value, FrameRef):
+        return os.path.getsize(value.path)
+    if isinstance(value, (tuple, list)):
+        return sum(_payload_bytes(v) for v in value)
+    return 0
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shared worker pool, started on first use."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: the server process has threads and a running loop that must not be forked
+            _POOL = ProcessPoolExecutor(
+                max_workers=WORKER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=WORKER_MAX_TASKS or None,
+            )
+        return _POOL
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is broken:
+            _POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_cpu(func, *args, size_hint: int | None = None, **kwargs):
+    """
+    Runs a blocking pandas/sklearn function off the event loop.
+    Large work goes to the worker pool, with frames in `args`/`kwargs` (and in
+    the result) passed through memory-mapped Arrow files instead of pickles;
+    small work runs on a thread. FrameRef arguments are loaded before `func`
+    sees them. `func` must be importable at module level.
+    `size_hint` gives the input size in bytes when it isn't in a frame (e.g. an upload on disk).
+    """
+    size = size_hint if size_hint is not None else _payload_bytes(args) + _payload_bytes(tuple(kwargs.values()))
+    if WORKER_PROCESSES <= 0 or size < OFFLOAD_MIN_BYTES:
+        return await asyncio.to_thread(_call_local, func, args, kwargs)
+
+    staged_args = await asyncio.to_thread(_stage, args)
+    staged_kwargs = {}
+    try:
+        for key, value in kwargs.items():
+            staged_kwargs[key] = await asyncio.to_thread(_stage, value)
+        pool = get_pool()
+        try:
+            result = await asyncio.wrap_future(pool.submit(_run_in_worker, func, staged_args, staged_kwargs))
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for the next request
+            _reset_pool(pool)
+            raise
+    finally:
+        _discard(staged_args)
+        _discard(tuple(staged_kwargs.values()))
+    return await asyncio.to_thread(_unstage, result, True)
@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Memory budget for cached parse results, in megabytes.
+PARSE_CACHE_MB = int(os.environ.get("MORPH_PARSE_CACHE_MB", "256"))
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Resident size of a frame, including the Python objects in object columns."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ParseCache:
+    """
+    Memory-bounded LRU of parse results keyed by upload digest plus parse
+    options, so re-uploads of the same bytes skip parsing.
+    Cached frames are shared with callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, nbytes: int):
+        if nbytes > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+PARSE_CACHE = ParseCache(PARSE_CACHE_MB * 1024 * 1024)
+
+
+def cache_key(digest: str, kind: str, **options) -> tuple:
+    """Builds a cache key from the upload digest, the result kind and parse options."""
+    return (digest, kind) + tuple(sorted(options.items()))
@@ -0,0 +1,374 @@
+import math
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from app.services.serializer import logical_dtype
+
+# HyperLogLog registers are 2**HLL_PRECISION bytes per column; 12 gives about 1.6% error.
+HLL_PRECISION = 12
+# t-digest compression; about this many centroids are kept per numeric column, denser at the tails.
+TDIGEST_COMPRESSION = 200
+# Frequent-value candidates kept per column (the top TOP_K are reported).
+TOPK_CAPACITY = 100
+TOP_K = 10
+# Distinct values per chunk whose types are checked to infer what a text column holds.
+TYPE_SAMPLE = 200
+# Rows profiled at a time; working memory follows this, not the frame's length.
+PROFILE_CHUNK_ROWS = int(os.environ.get("MORPH_PROFILE_CHUNK_ROWS", "1000000"))
+
+PROFILE_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+_BOOLEAN_WORDS = {"true", "false", "yes", "no"}
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Bit length of each uint64 (0 for 0); float64 holds 32-bit halves exactly."""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, np.frexp(hi)[1] + 32, np.frexp(lo)[1])
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes. Merging takes the register-wise max."""
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes: np.ndarray):
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes << np.uint64(p)  # the remaining bits, leading zeros first
+        rank = (65 - p - np.maximum(_bit_length(rest) - p, 0)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int32)).sum()
+        zeros = int((self.registers == 0).sum())
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))  # linear counting for small sets
+        return int(round(raw))
+
+
+class TDigest:
+    """
+    Quantile sketch: weighted centroids, small near the tails and large in
+    the middle (the k1 scale function). Points are added in batches and a
+    batch is clustered in one vectorized step, so adding chunk after chunk
+    and merging digests are the same operation.
+    """
+
+    __slots__ = ("compression", "means", "weights")
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def add(self, values: np.ndarray, weights: np.ndarray):
+        means = np.concatenate([self.means, values.astype(np.float64)])
+        weights = np.concatenate([self.weights, weights.astype(np.float64)])
+        order = np.argsort(means)
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        if not total:
+            return
+        # A point starts a new centroid when the cumulative weight before it crosses a k-unit
+        before = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * before - 1)
+        step = np.floor(k - k[0]).astype(np.intp)
+        cluster = np.r_[0, np.cumsum(step[1:] != step[:-1])]  # k is sorted, so clusters are runs
+        self.weights = np.bincount(cluster, weights=weights)
+        self.means = np.bincount(cluster, weights=means * weights) / self.weights
+
+    def merge(self, other: "TDigest"):
+        if len(other.means):
+            self.add(other.means, other.weights)
+
+    def quantiles(self, qs, low: float, high: float) -> list:
+        """Estimated values at quantiles `qs`, interpolated between centroids and the exact min/max."""
+        if not len(self.means):
+            return [None] * len(qs)
+        total = self.weights.sum()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return list(np.interp(np.asarray(qs) * total, np.r_[0.0, centres, total], np.r_[low, self.means, high]))
+
+
+class TopK:
+    """
+    Frequent values with their counts. Each update keeps the `capacity`
+    most frequent candidates; `error` bounds how far a reported count can
+    be below the true one (0 while nothing has been cut).
+    """
+
+    __slots__ = ("capacity", "counts", "error")
+
+    def __init__(self, capacity: int = TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series([], dtype=np.int64)
+        self.error = 0
+
+    def add(self, values: pd.Series, counts: np.ndarray, error: int = 0):
+        """Adds distinct `values` seen `counts` times (cut to the candidates before boxing them)."""
+        if len(counts) > self.capacity:
+            cut = np.argpartition(counts, len(counts) - self.capacity)
+            error = max(error, int(counts[cut[:-self.capacity]].max()))
+            keep = cut[-self.capacity:]
+            values, counts = values.iloc[keep], counts[keep]
+        index = pd.Index(values.to_numpy(dtype=object), dtype=object, tupleize_cols=False)
+        new = pd.Series(counts, index=index, dtype=np.int64)
+        combined = new if self.counts.empty else self.counts.add(new, fill_value=0).astype(np.int64)
+        if len(combined) > self.capacity:
+            ordered = combined.sort_values(ascending=False, kind="stable")
+            error = max(error, int(ordered.iloc[self.capacity]))
+            combined = ordered.iloc[:self.capacity]
+        self.counts = combined
+        self.error += error
+
+    def merge(self, other: "TopK"):
+        self.add(other.counts.index.to_series(), other.counts.to_numpy(), other.error)
+
+    def top(self, k: int = TOP_K) -> list:
+        ordered = self.counts.sort_values(ascending=False, kind="stable").iloc[:k]
+        return [{"value": _plain(v), "count": int(c)} for v, c in ordered.items()]
+
+
+def _plain(value):
+    """A sketch value as something JSON can carry."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if math.isfinite(value) else (None if value != value else str(value))
+    if isinstance(value, (str, int, bool)):
+        return value
+    return str(value)
+
+
+def _value_kind(value) -> str:
+    """What a single value of an object/text column looks like."""
+    if isinstance(value, (bool, np.bool_)):
+        return "boolean"
+    if isinstance(value, (int, np.integer)):
+        return "integer"
+    if isinstance(value, (float, np.floating)):
+        return "integer" if float(value).is_integer() else "float"
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "isoformat"):
+        return "datetime"
+    if not isinstance(value, str):
+        return "string"
+    text = value.strip()
+    if not text:
+        return "empty"
+    if text.lower() in _BOOLEAN_WORDS:
+        return "boolean"
+    try:
+        number = float(text.replace(",", ""))
+        return "integer" if number.is_integer() and "." not in text else "float"
+    except ValueError:
+        pass
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if pd.notna(pd.to_datetime(text, errors="coerce", format="mixed")):
+            return "datetime"
+    return "string"
+
+
+class ColumnSketch:
+    """
+    Everything the profile reports for one column, built from chunks. One
+    factorize per chunk drives all of it: null count from the missing
+    codes, and value counts per distinct value for the distinct estimate,
+    min/max, quantiles (numbers and dates) and frequent values.
+    """
+
+    def __init__(self, name, dtype: str, tz=None):
+        self.name = name
+        self.dtype = dtype
+        self.tz = tz
+        self.count = 0
+        self.nulls = 0
+        self.hll = HyperLogLog()
+        self.digest = TDigest() if dtype in ("integer", "float", "datetime") else None
+        self.top = TopK()
+        self.minimum = None
+        self.maximum = None
+        self.kinds = {}  # inferred kind -> distinct sampled values of that kind
+
+    @classmethod
+    def for_column(cls, name, column: pd.Series) -> "ColumnSketch":
+        return cls(name, logical_dtype(column), getattr(column.dtype, "tz", None))
+
+    def update(self, column: pd.Series):
+        codes, uniques = pd.factorize(column)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        used = np.flatnonzero(counts)
+        if len(used) < len(uniques):
+            uniques, counts = uniques.take(used), counts[used]  # e.g. unused categories
+        self.count += len(column)
+        self.nulls += int((codes < 0).sum())
+        if not len(uniques):
+            return
+        values = pd.Series(uniques, copy=False)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        # Duplicates don't change a HyperLogLog, so only the distinct values are hashed
+        self.hll.add(pd.util.hash_pandas_object(values, index=False).to_numpy())
+        self.top.add(values, counts)
+
+        if self.digest is not None:
+            if self.dtype == "datetime":
+                numbers = values.dt.as_unit("ns").astype(np.int64).to_numpy()  # UTC for tz-aware
+                self._extend(numbers.min(), numbers.max())
+            else:
+                numbers = values.to_numpy(dtype=np.float64)
+                self._extend(values.min(), values.max())  # exact, even past float precision
+            finite = np.isfinite(numbers)
+            if finite.any():
+                self.digest.add(numbers[finite], counts[finite])
+        else:
+            try:
+                self._extend(values.min(), values.max())
+            except (TypeError, ValueError):
+                pass  # values without an order (mixed types)
+            if self.dtype in ("string", "category"):
+                for value in values.iloc[:TYPE_SAMPLE].to_numpy(dtype=object):
+                    kind = _value_kind(value)
+                    self.kinds[kind] = self.kinds.get(kind, 0) + 1
+
+    def _extend(self, low, high):
+        try:
+            if self.minimum is None or low < self.minimum:
+                self.minimum = low
+            if self.maximum is None or high > self.maximum:
+                self.maximum = high
+        except TypeError:
+            pass
+
+    def merge(self, other: "ColumnSketch"):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.hll.merge(other.hll)
+        self.top.merge(other.top)
+        if self.digest is not None and other.digest is not None:
+            self.digest.merge(other.digest)
+        if other.minimum is not None:
+            self._extend(other.minimum, other.maximum)
+        for kind, n in other.kinds.items():
+            self.kinds[kind] = self.kinds.get(kind, 0) + n
+
+    def inferred_type(self) -> str:
+        """The column's type, or for text columns what their values look like."""
+        if self.dtype not in ("string", "category"):
+            return self.dtype
+        kinds = {k: n for k, n in self.kinds.items() if k != "empty"}
+        total = sum(kinds.values())
+        if not total:
+            return "empty"
+        if set(kinds) <= {"integer", "float"}:
+            return "float" if "float" in kinds else "integer"
+        kind, n = max(kinds.items(), key=lambda item: item[1])
+        return kind if n >= 0.95 * total else "mixed"
+
+    def _scalar(self, value):
+        if value is None:
+            return None
+        if self.dtype == "datetime":
+            return _plain(pd.Timestamp(int(round(value)), tz=self.tz))
+        if self.dtype == "integer" and isinstance(value, (float, np.floating)):
+            return _plain(float(value)) if not float(value).is_integer() else int(value)
+        return _plain(value)
+
+    def to_dict(self) -> dict:
+        non_null = self.count - self.nulls
+        result = {
+            "name": str(self.name),
+            "dtype": self.dtype,
+            "inferred_type": self.inferred_type(),
+            "count": self.count,
+            "nulls": self.nulls,
+            "null_pct": round(100 * self.nulls / self.count, 2) if self.count else 0.0,
+            # The estimate can overshoot on small columns; it can't exceed the non-null count
+            "distinct": min(self.hll.estimate(), non_null),
+            "min": self._scalar(self.minimum),
+            "max": self._scalar(self.maximum),
+            "top": self.top.top(),
+            "top_exact": self.top.error == 0,
+        }
+        if self.digest is not None:
+            # Infinities are left out of the digest, so its ends bound the interpolation instead
+            means = self.digest.means
+            low, high = (float(self.minimum), float(self.maximum)) if len(means) else (None, None)
+            if len(means) and not math.isfinite(low):
+                low = means[0]
+            if len(means) and not math.isfinite(high):
+                high = means[-1]
+            values = self.digest.quantiles(PROFILE_QUANTILES, low, high)
+            # Quantiles are estimates even for integer columns, so they stay floats (dates to the second)
+            if self.dtype == "datetime":
+                values = [None if v is None else round(v / 1e9) * 1e9 for v in values]
+                convert = self._scalar
+            else:
+                convert = _plain
+            result["quantiles"] = {f"p{round(q * 100)}": convert(v) for q, v in zip(PROFILE_QUANTILES, values)}
+        return result
+
+
+class FrameProfile:
+    """
+    Column sketches for a frame fed chunk by chunk (slices of one frame, or
+    read_csv chunks with the same columns). Profiles of different chunks
+    merge into the profile of their concatenation, up to sketch error.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = []
+
+    def update(self, chunk: pd.DataFrame):
+        if not self.columns:
+            self.columns = [ColumnSketch.for_column(name, chunk.iloc[:, j]) for j, name in enumerate(chunk.columns)]
+        elif len(self.columns) != chunk.shape[1]:
+            raise ValueError("Chunk has a different number of columns than the profile.")
+        for j, sketch in enumerate(self.columns):
+            sketch.update(chunk.iloc[:, j])
+        self.rows += len(chunk)
+
+    def merge(self, other: "FrameProfile"):
+        if not self.columns:
+            self.columns = other.columns
+        elif other.columns:
+            if len(other.columns) != len(self.columns):
+                raise ValueError("Profiles have different columns.")
+            for mine, theirs in zip(self.columns, other.columns):
+                mine.merge(theirs)
+        self.rows += other.rows
+
+    @property
+    def nulls(self) -> int:
+        return sum(sketch.nulls for sketch in self.columns)
+
+    def to_dict(self) -> dict:
+        return {"rows": self.rows, "columns": [sketch.to_dict() for sketch in self.columns]}
+
+
+def profile_frame(df: pd.DataFrame, chunk_rows: int = PROFILE_CHUNK_ROWS) -> FrameProfile:
+    """Profiles `df` in slices of `chunk_rows`, so working memory stays bounded for long frames."""
+    profile = FrameProfile()
+    if df.shape[1] and not len(df):
+        profile.update(df)
+    for start in range(0, len(df), max(1, chunk_rows)):
+        profile.update(df.iloc[start:start + chunk_rows])
+    return profile
@@ -0,0 +1,154 @@
+import json
+import math
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import StreamingResponse
+
+# Rows encoded per streamed chunk; bounds the transient string memory of a response.
+JSON_CHUNK_ROWS = 20_000
+
+
+def logical_dtype(series: pd.Series) -> str:
+    """Maps a pandas dtype onto the small set of type names the frontend understands."""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category"
+    return "string"
+
+
+def _dumps_str(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _scalar_fragment(value, nan: str, inf: str) -> str:
+    """JSON text for one cell of an object column."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return nan
+    if isinstance(value, str):
+        return _dumps_str(value)
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value):
+            return nan
+        if math.isinf(value):
+            return inf
+        return repr(float(value))
+    if isinstance(value, (datetime, date)):
+        return '"' + value.isoformat() + '"'
+    return _dumps_str(str(value))
+
+
+def json_fragments(series: pd.Series, nan: str = "null", inf: str = "null") -> np.ndarray:
+    """
+    Encodes one column to an object array of JSON text fragments.
+    Numeric, boolean, datetime and categorical columns are encoded in bulk
+    from their NumPy buffers with NaN/inf patched through masks; only
+    object/string columns fall back to per-cell encoding.
+    `nan` and `inf` are the JSON literals written for missing and infinite values.
+    """
+    dtype = series.dtype
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Encode each category once, then take by code (-1 -> the trailing missing literal)
+        categories = json_fragments(pd.Series(dtype.categories), nan, inf)
+        lookup = np.append(categories, np.array([nan], dtype=object))
+        return lookup[series.cat.codes.to_numpy()]
+
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        out = ('"' + series.dt.strftime("%Y-%m-%dT%H:%M:%S") + '"').to_numpy(dtype=object)
+        out[series.isna().to_numpy()] = nan
+        return out
+
+    if isinstance(dtype, np.dtype):
+        values = series.to_numpy()
+        if dtype.kind == "b":
+            return np.where(values, "true", "false").astype(object)
+        if dtype.kind in "iu":
+            return values.astype(str).astype(object)
+        if dtype.kind == "f":
+            out = values.astype(str).astype(object)
+            out[np.isnan(values)] = nan
+            out[np.isinf(values)] = inf
+            return out
+
+    if pd.api.types.is_string_dtype(dtype) and pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty"):
+        missing = series.isna().to_numpy()
+        out = np.full(len(series), nan, dtype=object)
+        out[~missing] = list(map(_dumps_str, series.to_numpy(dtype=object)[~missing]))
+        return out
+
+    # Mixed object columns and nullable extension types
+    return np.array([_scalar_fragment(v, nan, inf) for v in series.to_numpy(dtype=object)], dtype=object)
+
+
+def records_json_chunks(df: pd.DataFrame, nan: str = "null", inf: str = "null", chunk_rows: int = JSON_CHUNK_ROWS):
+    """
+    Yields the rows of `df` as the inside of a JSON array of objects,
+    one chunk of rows at a time.
+    """
+    keys = np.array([_dumps_str(str(c)) + ":" for c in df.columns], dtype=object)
+    for start in range(0, len(df), chunk_rows):
+        part = df.iloc[start:start + chunk_rows]
+        if df.shape[1] == 0:
+            rows = ["{}"] * len(part)
+        else:
+            cols = [keys[j] + json_fragments(part.iloc[:, j], nan, inf) for j in range(df.shape[1])]
+            rows = ["{" + ",".join(row) + "}" for row in zip(*cols)]
+        yield ("," if start else "") + ",".join(rows)
+
+
+def _envelope(meta: dict, key: str) -> str:
+    """Opening text of `meta` as a JSON object, left open for one more array field."""
+    head = json.dumps(meta, ensure_ascii=False, default=str)
+    return head[:-1] + ("," if meta else "") + _dumps_str(key) + ":["
+
+
+def records_response(meta: dict, df: pd.DataFrame, nan: str = "null", inf: str = "null",
+                     key: str = "data") -> StreamingResponse:
+    """
+    Streams `meta` plus the frame as a list of row objects under `key`,
+    encoding straight from the column buffers (no object-dtype copy of the frame).
+    """
+    def body():
+        yield _envelope(meta, key).encode()
+        for chunk in records_json_chunks(df, nan, inf):
+            yield chunk.encode()
+        yield b"]}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+def columnar_response(meta: dict, df: pd.DataFrame, nan: str = "null", inf: str = "null") -> StreamingResponse:
+    """
+    Streams the columnar body: headers, logical dtypes and one array per
+    column, plus the fields in `meta`.
+    """
+    body_meta = {
+        "format": "columnar",
+        "headers": [str(col) for col in df.columns],
+        "dtypes": [logical_dtype(df.iloc[:, i]) for i in range(df.shape[1])],
+        "row_count": len(df),
+    }
+    body_meta.update(meta)
+
+    def body():
+        yield _envelope(body_meta, "columns").encode()
+        for j in range(df.shape[1]):
+            fragments = json_fragments(df.iloc[:, j], nan, inf)
+            yield (("," if j else "") + "[" + ",".join(fragments) + "]").encode()
+        yield b"]}"
+
+    return StreamingResponse(body(), media_type="application/json")
@@ -0,0 +1,66 @@
+import os
+import re
+import uuid
+
+from fastapi import Request
+from starlette.requests import cookie_parser
+
+# Cookie that ties a browser to the datasets it uploaded.
+SESSION_COOKIE = "morph_session"
+SESSION_MAX_AGE = int(os.environ.get("MORPH_SESSION_MAX_AGE", str(7 * 24 * 3600)))
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SessionMiddleware:
+    """
+    ASGI middleware that gives every client an opaque session ID cookie
+    and exposes it to handlers as request.state.session_id.
+    """
+
+    def __init__(self, app, cookie_name: str = SESSION_COOKIE, max_age: int = SESSION_MAX_AGE):
+        self.app = app
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cookie_header = ""
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                cookie_header = value.decode("latin-1")
+                break
+        session_id = cookie_parser(cookie_header).get(self.cookie_name, "")
+        issue = not _SESSION_ID.match(session_id)
+        if issue:
+            session_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["session_id"] = session_id
+
+        if not issue:
+            await self.app(scope, receive, send)
+            return
+
+        cookie = (
+            f"{self.cookie_name}={session_id}; Path=/; Max-Age={self.max_age}; HttpOnly; SameSite=Lax"
+        ).encode("latin-1")
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def session_owner(request: Request) -> str:
+    """Owner key for server-held data: the session cookie, else the client address."""
+    session_id = getattr(request.state, "session_id", None)
+    if session_id:
+        return f"session:{session_id}"
+    host = request.client.host if request.client else "unknown"
+    return f"client:{host}"
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+import pandas as pd
+
+# Set MORPH_SHARED_DATASETS=1 when several server processes (gunicorn/uvicorn workers)
+# run on one host, so a dataset parsed by one worker can be served by any other.
+SHARED_DATASETS = os.environ.get("MORPH_SHARED_DATASETS", "0") == "1"
+# Where the shared Arrow files and their index live; tmpfs (/dev/shm) keeps them in RAM.
+SHARED_DIR = os.environ.get("MORPH_SHARED_DATASET_DIR") or os.path.join(
+    "/dev/shm" if os.access("/dev/shm", os.W_OK) else tempfile.gettempdir(), "morph_datasets"
+)
+# Size budget for the shared directory, in megabytes; past it the least recently used go first.
+SHARED_MAX_MB = int(os.environ.get("MORPH_SHARED_DATASET_MB", "4096"))
+# A dataset no worker references any more is deleted after this many idle seconds.
+SHARED_IDLE_SECONDS = int(os.environ.get("MORPH_SHARED_DATASET_IDLE_SECONDS", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS current (
+    owner TEXT PRIMARY KEY,
+    dataset_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    dataset_id TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, pid)
+);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedDatasetStore:
+    """
+    Datasets as Arrow IPC files in a directory every worker on the host can
+    map, indexed by a SQLite file next to them. Each worker process holding
+    a dataset adds a reference; a dataset is deleted once no live worker
+    references it and it has sat idle, or when the directory is over budget.
+    Workers map the files read-only, so the columns live in the shared page
+    cache rather than in each worker's heap.
+    """
+
+    def __init__(self, directory: str = SHARED_DIR, max_bytes: int = SHARED_MAX_MB * 1024 * 1024,
+                 idle_seconds: int = SHARED_IDLE_SECONDS):
+        self.directory = directory
+        self.db_path = os.path.join(directory, "index.sqlite3")
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._ready = False
+
+    @property
+    def pid(self) -> int:
+        # Looked up each time: workers forked from a preloading master have their own PID
+        return os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.close()
+            self._ready = True
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _db(self):
+        return closing(self._connect())
+
+    def publish(self, dataset_id: str, owner: str, df: pd.DataFrame, make_current: bool = False) -> str | None:
+        """
+        Writes the frame to the shared directory and returns its path, or None
+        when Arrow can't represent it (the dataset then stays with this worker).
+        The owner's current dataset is updated either way.
+        """
+        from app.services.dataset_store import _write_spill
+
+        path = os.path.join(self.directory, f"{dataset_id}.arrow")
+        partial = path + ".partial"
+        self._connect().close()
+        size = None
+        try:
+            size = _write_spill(df, partial)
+            if size is not None:
+                os.replace(partial, path)  # readers never see a half-written file
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        now = time.time()
+        with self._db() as conn:
+            if size is not None:
+                conn.execute(
+                    "INSERT INTO datasets (id, owner, path, columns, bytes, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (dataset_id, owner, path, json.dumps(list(df.columns)), size, now, now),
+                )
+                conn.execute("INSERT OR IGNORE INTO refs (dataset_id, pid) VALUES (?, ?)", (dataset_id, self.pid))
+            if make_current:
+                conn.execute("INSERT OR REPLACE INTO current (owner, dataset_id) VALUES (?, ?)", (owner, dataset_id))
+        return path if size is not None else None
+
+    def acquire(self, dataset_id: str, owner: str) -> tuple | None:
+        """References a dataset for this worker; returns (path, columns), or None if unknown to `owner`."""
+        with self._db() as conn:
+            row = conn.execute("SELECT owner, path, columns FROM datasets WHERE id = ?", (dataset_id,)).fetchone()
+            if row is None or row["owner"] != owner:
+                return None
+            conn.execute("INSERT OR IGNORE INTO refs (dataset_id, pid) VALUES (?, ?)", (dataset_id, self.pid))
+            conn.execute("UPDATE datasets SET last_used = ? WHERE id = ?", (time.time(), dataset_id))
+        return row["path"], json.loads(row["columns"])
+
+    def release(self, dataset_id: str):
+        """Drops this worker's reference; the idle clock starts from now."""
+        with self._db() as conn:
+            conn.execute("DELETE FROM refs WHERE dataset_id = ? AND pid = ?", (dataset_id, self.pid))
+            conn.execute("UPDATE datasets SET last_used = ? WHERE id = ?", (time.time(), dataset_id))
+
+    def release_all(self):
+        """Drops every reference this worker holds (on shutdown)."""
+        if not self._ready:
+            return
+        with self._db() as conn:
+            conn.execute("UPDATE datasets SET last_used = ? WHERE id IN (SELECT dataset_id FROM refs WHERE pid = ?)",
+                         (time.time(), self.pid))
+            conn.execute("DELETE FROM refs WHERE pid = ?", (self.pid,))
+
+    def current(self, owner: str) -> str | None:
+        with self._db() as conn:
+            row = conn.execute("SELECT dataset_id FROM current WHERE owner = ?", (owner,)).fetchone()
+        return row["dataset_id"] if row else None
+
+    def collect(self) -> int:
+        """
+        Clears references left by workers that died, then deletes idle
+        unreferenced datasets and, while over budget, the least recently
+        used ones. Returns how many datasets were deleted.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            pids = [row["pid"] for row in conn.execute("SELECT DISTINCT pid FROM refs")]
+            dead = [(pid,) for pid in pids if not _pid_alive(pid)]
+            conn.executemany("DELETE FROM refs WHERE pid = ?", dead)
+            rows = conn.execute(
+                "SELECT d.id, d.path, d.bytes, d.last_used, COUNT(r.pid) AS refs FROM datasets d "
+                "LEFT JOIN refs r ON r.dataset_id = d.id GROUP BY d.id "
+                "ORDER BY refs > 0, d.last_used"
+            ).fetchall()
+            total = sum(row["bytes"] for row in rows)
+            doomed = []
+            for row in rows:
+                idle = not row["refs"] and now - row["last_used"] > self.idle_seconds
+                if idle or total > self.max_bytes:
+                    doomed.append(row)
+                    total -= row["bytes"]
+            for row in doomed:
+                conn.execute("DELETE FROM datasets WHERE id = ?", (row["id"],))
+                conn.execute("DELETE FROM refs WHERE dataset_id = ?", (row["id"],))
+                conn.execute("DELETE FROM current WHERE dataset_id = ?", (row["id"],))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        # Workers that still have a file mapped keep reading it; unlinking only frees it once they let go
+        for row in doomed:
+            try:
+                os.remove(row["path"])
+            except OSError:
+                pass
+        return len(doomed)
+
+    def stats(self) -> dict:
+        with self._db() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(bytes), 0) AS bytes FROM datasets").fetchone()
+            refs = conn.execute("SELECT COUNT(*) AS n, COUNT(DISTINCT pid) AS workers FROM refs").fetchone()
+        return {
+            "directory": self.directory,
+            "datasets": row["n"],
+            "bytes": row["bytes"],
+            "max_bytes": self.max_bytes,
+            "references": refs["n"],
+            "workers": refs["workers"],
+        }
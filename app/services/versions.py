@@ -0,0 +1,363 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.services.dataset_store import DatasetNotFound, get_dataset
+
+# Snapshots kept per dataset; past it the oldest one that isn't the head is dropped.
+MAX_VERSIONS = int(os.environ.get("MORPH_MAX_VERSIONS", "32"))
+# Memory budget for all version histories, in megabytes; least recently used histories go first.
+VERSION_BUDGET_MB = int(os.environ.get("MORPH_VERSION_BUDGET_MB", "1024"))
+# Materialized snapshot frames kept per history (normally just the head).
+FRAMES_PER_HISTORY = 1
+
+
+class VersionNotFound(DatasetNotFound):
+    """Raised for a version number a dataset's history doesn't hold."""
+
+
+class VersionConflict(ValueError):
+    """Raised when a dataset's head moved while a version was being made from it."""
+
+
+def _owner_buffer(values):
+    """The array that owns a column's memory (a column of a 2-D block is a view of it)."""
+    data = values.to_numpy() if isinstance(values, pd.arrays.NumpyExtensionArray) else values
+    if isinstance(data, np.ndarray):
+        while isinstance(data.base, np.ndarray):
+            data = data.base
+    return data
+
+
+def _buffer_nbytes(values) -> int:
+    if pd.api.types.is_object_dtype(values.dtype):
+        return int(pd.Series(values, copy=False).memory_usage(index=False, deep=True))
+    return int(values.nbytes)
+
+
+def _rows_nbytes(column: "_Column", rows: int) -> int:
+    """Bytes `rows` rows of the column take as a separate array."""
+    return int(column.nbytes / max(1, len(column.values)) * rows)
+
+
+def _same_buffer(a, b) -> bool:
+    if a is b:
+        return True
+    owner = _owner_buffer(a)
+    return isinstance(owner, np.ndarray) and owner is _owner_buffer(b)
+
+
+def _own_copy(values):
+    """A column that doesn't pin the 2-D block it was sliced from."""
+    buffer = _owner_buffer(values)
+    if isinstance(buffer, np.ndarray) and buffer.size > len(values):
+        return values.copy()
+    return values
+
+
+class _Column:
+    """A snapshot's column: a shared buffer, and which of its rows the snapshot shows."""
+
+    __slots__ = ("key", "name", "values", "positions", "nbytes")
+
+    def __init__(self, key: int, name, values, positions: np.ndarray | None = None, nbytes: int | None = None):
+        self.key = key  # identity kept across renames, for diffs
+        self.name = name
+        self.values = values
+        self.positions = positions  # None: every row of `values`, in order
+        self.nbytes = _buffer_nbytes(values) if nbytes is None else nbytes
+
+    def buffer(self) -> tuple:
+        """(id, bytes) of the memory behind `values`; columns of one 2-D block share it."""
+        if pd.api.types.is_object_dtype(self.values.dtype):
+            return id(self.values), self.nbytes  # deep size of this column's objects
+        owner = _owner_buffer(self.values)
+        return id(owner), int(owner.nbytes) if isinstance(owner, np.ndarray) else self.nbytes
+
+    def materialize(self):
+        return self.values if self.positions is None else self.values.take(self.positions)
+
+
+class Snapshot:
+    __slots__ = ("number", "parent", "label", "columns", "row_ids", "created_at")
+
+    def __init__(self, number: int, parent: int | None, label: str, columns: list, row_ids: np.ndarray):
+        self.number = number
+        self.parent = parent
+        self.label = label
+        self.columns = columns
+        self.row_ids = row_ids  # original row positions, ascending
+        self.created_at = time.time()
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def describe(self) -> dict:
+        return {
+            "version": self.number,
+            "parent": self.parent,
+            "label": self.label,
+            "rows": len(self),
+            "columns": [str(c.name) for c in self.columns],
+            "created_at": self.created_at,
+        }
+
+
+class VersionHistory:
+    """
+    The versions of one dataset. Snapshots share column buffers: a version
+    made by filtering rows keeps its parent's buffers plus an array of row
+    positions, and one that rewrites a few columns stores only those. Reading
+    a version builds a frame from its columns (the last one read is cached,
+    and counted with the buffers for what it doesn't share with them);
+    reverting only moves the head.
+    """
+
+    def __init__(self, owner: str, df: pd.DataFrame, max_versions: int = MAX_VERSIONS):
+        self.owner = owner
+        self.max_versions = max_versions
+        columns = [_Column(j, name, df.iloc[:, j].array) for j, name in enumerate(df.columns)]
+        self.snapshots = OrderedDict({0: Snapshot(0, None, "original", columns, np.arange(len(df)))})
+        self.head = 0
+        self._next = 1
+        self._frames = OrderedDict({0: (df, 0)})  # number -> (frame, bytes not shared with snapshots)
+        self._lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+    def snapshot(self, number) -> Snapshot:
+        with self._lock:
+            number = self.head if number in (None, "head") else number
+            try:
+                return self.snapshots[int(number)]
+            except (KeyError, ValueError, TypeError):
+                raise VersionNotFound(number)
+
+    def frame(self, number=None) -> pd.DataFrame:
+        """The version as a frame (read-only, like registered datasets)."""
+        snapshot = self.snapshot(number)
+        with self._lock:
+            self.last_used = time.monotonic()
+            cached = self._frames.get(snapshot.number)
+            if cached is not None:
+                self._frames.move_to_end(snapshot.number)
+                return cached[0]
+        df = pd.DataFrame({j: c.materialize() for j, c in enumerate(snapshot.columns)}, copy=False)
+        df.columns = [c.name for c in snapshot.columns]
+        # Columns read through row positions are copies; the others are the buffers themselves
+        extra = sum(_rows_nbytes(c, len(snapshot)) for c in snapshot.columns if c.positions is not None)
+        with self._lock:
+            self._cache_frame(snapshot.number, df, extra)
+        return df
+
+    def _cache_frame(self, number: int, df: pd.DataFrame, extra: int):
+        self._frames[number] = (df, extra)
+        self._frames.move_to_end(number)
+        while len(self._frames) > FRAMES_PER_HISTORY:
+            self._frames.popitem(last=False)
+
+    def commit(self, parent_number, df: pd.DataFrame, sources: tuple, label: str,
+               expect_head: int | None = None) -> Snapshot:
+        """
+        Adds `df`, derived from version `parent_number`, as a new head.
+        `sources` are the parent positions of df's rows and columns (as
+        returned by perform_cleaning/run_plan with_sources=True). Columns whose
+        values are unchanged share the parent's buffer; only the others are kept.
+        With `expect_head`, raises VersionConflict if the head is no longer that
+        version (another commit or revert landed while df was being made).
+        """
+        parent = self.snapshot(parent_number)
+        rows, column_sources = sources
+        rows = np.asarray(rows, dtype=np.intp)
+        all_rows = len(rows) == len(parent) and bool((rows == np.arange(len(parent))).all())
+        composed = {}  # id(parent positions) -> positions after the row filter, shared by columns
+        columns = []
+        extra = 0  # bytes of df (cached as the head's frame) not shared with the snapshot
+        for k, j in enumerate(column_sources):
+            source = parent.columns[j]
+            new = df.iloc[:, k].array
+            if all_rows:
+                positions = source.positions
+            else:
+                key = id(source.positions)
+                if key not in composed:
+                    composed[key] = rows if source.positions is None else source.positions[rows]
+                positions = composed[key]
+            shared = _Column(source.key, df.columns[k], source.values, positions, source.nbytes)
+            if new.dtype == source.values.dtype and new.equals(shared.materialize()):
+                columns.append(shared)
+                if positions is not None or not _same_buffer(new, source.values):
+                    extra += _rows_nbytes(source, len(df))
+            else:
+                own = _own_copy(new)
+                columns.append(_Column(source.key, df.columns[k], own))
+                if own is not new:
+                    extra += columns[-1].nbytes
+        with self._lock:
+            if expect_head is not None and self.head != expect_head:
+                raise VersionConflict(expect_head)
+            snapshot = Snapshot(self._next, parent.number, label, columns, parent.row_ids[rows])
+            self.snapshots[snapshot.number] = snapshot
+            self._next += 1
+            self.head = snapshot.number
+            self._cache_frame(snapshot.number, df, extra)
+            while len(self.snapshots) > self.max_versions:
+                oldest = next(n for n in self.snapshots if n != self.head)
+                del self.snapshots[oldest]
+                self._frames.pop(oldest, None)
+            self.last_used = time.monotonic()
+        return snapshot
+
+    def revert(self, number) -> Snapshot:
+        """Makes an earlier (or later) version the head. Nothing is copied or dropped."""
+        snapshot = self.snapshot(number)
+        with self._lock:
+            self.head = snapshot.number
+            self.last_used = time.monotonic()
+        return snapshot
+
+    def diff(self, a, b) -> dict:
+        """
+        What changed from version `a` to version `b`: rows removed and added
+        (by original row), columns added, removed and renamed, and changed
+        cells per column. Columns still backed by the same buffer and rows are
+        skipped without reading their values. When `b` only drops rows and
+        columns of `a`, `patch` is the delta (see frame_delta) that turns
+        a's rows into b's.
+        """
+        from app.services.delta import frame_delta
+        from app.services.serializer import json_fragments
+
+        first, second = self.snapshot(a), self.snapshot(b)
+        kept = np.isin(first.row_ids, second.row_ids)
+        added = ~np.isin(second.row_ids, first.row_ids)
+        first_pos = np.flatnonzero(kept)  # common rows, in both versions' order
+        second_pos = np.flatnonzero(~added)
+        first_keys = {c.key: j for j, c in enumerate(first.columns)}
+        second_keys = {c.key for c in second.columns}
+
+        changed = {}
+        renamed = {}
+        for column in second.columns:
+            j = first_keys.get(column.key)
+            if j is None:
+                continue
+            before = first.columns[j]
+            if before.name != column.name:
+                renamed[str(before.name)] = str(column.name)
+            if before.values is column.values:
+                p = first_pos if before.positions is None else before.positions[first_pos]
+                q = second_pos if column.positions is None else column.positions[second_pos]
+                if np.array_equal(p, q):
+                    continue
+            old = json_fragments(pd.Series(before.materialize()).iloc[first_pos])
+            new = json_fragments(pd.Series(column.materialize()).iloc[second_pos])
+            count = int((old != new).sum())
+            if count:
+                changed[str(column.name)] = count
+
+        result = {
+            "from": first.number,
+            "to": second.number,
+            "rows_removed": int((~kept).sum()),
+            "rows_added": int(added.sum()),
+            "columns_removed": [str(c.name) for c in first.columns if c.key not in second_keys],
+            "columns_added": [str(c.name) for c in second.columns if c.key not in first_keys],
+            "renamed": renamed,
+            "cells_changed": changed,
+        }
+        if not added.any() and all(c.key in first_keys for c in second.columns):
+            result["patch"] = frame_delta(self.frame(first.number), self.frame(second.number),
+                                          first_pos, [first_keys[c.key] for c in second.columns])
+        return result
+
+    def buffers(self) -> dict:
+        """
+        id -> bytes of every buffer (column values and row positions) the
+        snapshots hold, plus what cached frames hold beyond those buffers.
+        """
+        with self._lock:
+            snapshots = list(self.snapshots.values())
+            frames = {number: extra for number, (_, extra) in self._frames.items()}
+        found = {("frame", number): extra for number, extra in frames.items() if extra}
+        for snapshot in snapshots:
+            for column in snapshot.columns:
+                key, nbytes = column.buffer()
+                found[key] = nbytes
+                if column.positions is not None and id(column.positions) not in found:
+                    found[id(column.positions)] = int(column.positions.nbytes)
+        return found
+
+    def describe(self) -> dict:
+        with self._lock:
+            snapshots = list(self.snapshots.values())
+        held = sum(self.buffers().values())
+        # What the same versions would take as separate frames
+        copies = sum(c.nbytes / max(1, len(c.values)) * len(s) for s in snapshots for c in s.columns)
+        return {
+            "head": self.head,
+            "versions": [s.describe() for s in snapshots],
+            "bytes": held,
+            "bytes_as_copies": int(copies),
+        }
+
+
+class VersionStore:
+    """Version histories per owner and dataset, within a process-wide memory budget."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._histories: "OrderedDict[tuple, VersionHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def history(self, owner: str, dataset_id: str, create: bool = True) -> VersionHistory:
+        """The dataset's history; the first call snapshots the registered frame as version 0."""
+        key = (owner, dataset_id)
+        with self._lock:
+            history = self._histories.get(key)
+            if history is not None:
+                self._histories.move_to_end(key)
+                return history
+        if not create:
+            raise DatasetNotFound(dataset_id)
+        df = get_dataset(dataset_id, owner)
+        with self._lock:
+            history = self._histories.setdefault(key, VersionHistory(owner, df))
+            self._histories.move_to_end(key)
+        return history
+
+    def relieve(self, keep: VersionHistory):
+        """Drops least recently used histories while over budget."""
+        with self._lock:
+            histories = list(self._histories.items())
+        total = {id(h): sum(h.buffers().values()) for _, h in histories}
+        used = sum(total.values())
+        for key, history in histories:
+            if used <= self.max_bytes:
+                break
+            if history is keep:
+                continue
+            with self._lock:
+                self._histories.pop(key, None)
+            used -= total[id(history)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            histories = list(self._histories.values())
+        return {
+            "histories": len(histories),
+            "versions": sum(len(h.snapshots) for h in histories),
+            "bytes": sum(sum(h.buffers().values()) for h in histories),
+            "max_bytes": self.max_bytes,
+        }
+
+
+VERSIONS = VersionStore(VERSION_BUDGET_MB * 1024 * 1024)
+
+
+def version_frame(owner: str, dataset_id: str, version) -> pd.DataFrame:
+    """A version of a dataset as a frame; "head" (or None) is the current head."""
+    return VERSIONS.history(owner, dataset_id).frame(version)
@@ -0,0 +1,99 @@
+import datetime
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.cleaning import HEADER_KEYWORDS, HEADER_SCAN_ROWS, header_scores
+from app.services.dtype_optimizer import optimize_frame
+
+
+def legacy_header_row(df):
+    """The row-by-row header finder perform_cleaning used before header_scores."""
+    best_row_index = -1
+    max_score = 0
+    for i in range(min(HEADER_SCAN_ROWS, len(df))):
+        row = df.iloc[i]
+        row_str = str(row.tolist()).lower()
+        text_count = sum(1 for val in row if isinstance(val, str) and len(str(val).strip()) > 0)
+        keyword_bonus = sum(5 for k in HEADER_KEYWORDS if k in row_str)
+        if (text_count + keyword_bonus) > max_score:
+            max_score = text_count + keyword_bonus
+            best_row_index = i
+    return best_row_index, max_score
+
+
+def vectorized_header_row(df):
+    scores = header_scores(df.iloc[:HEADER_SCAN_ROWS])
+    if len(scores) and scores.max() > 0:
+        best = int(scores.argmax())
+        return best, int(scores[best])
+    return -1, 0
+
+
+def messy_sheet(rows, cols, seed):
+    """A sheet with a title block, a header row a few lines down, and mixed column types."""
+    rng = np.random.default_rng(seed)
+    # Includes cells whose repr differs from their text ("\tOTAL" -> "\\total"), blank-ish and non-ASCII text
+    words = ["Product Name", "Order Date", "Unit Price", "  ", "", "\x1c", "Total", "north", "SKU-1",
+             "\nidle", "\tOTAL", "İD", "Costa Rica"]
+    data = {}
+    for j in range(cols):
+        kind = j % 5
+        if kind == 0:
+            column = rng.choice(words, rows).astype(object)
+        elif kind == 1:
+            column = rng.normal(size=rows)
+        elif kind == 2:
+            column = pd.date_range("2024-01-01", periods=rows, freq="D", tz="America/Costa_Rica")
+        elif kind == 3:
+            column = [datetime.date(2024, 1, 1) if r % 7 == 0 else None for r in range(rows)]
+        else:
+            column = pd.array(rng.choice(["a", "b", None], rows), dtype="str")
+        data[f"Unnamed: {j}"] = column
+    df = pd.DataFrame(data)
+    df.iloc[int(rng.integers(0, min(rows, HEADER_SCAN_ROWS))), 0] = "ID"
+    return df
+
+
+def titled_upload(rows, cols, seed):
+    """
+    A CSV export with a report title above the real header, parsed the way
+    uploads are: every column comes back 'Unnamed' and text-typed.
+    """
+    rng = np.random.default_rng(seed)
+    names = ["Order ID", "Product Name", "Order Date", "Unit Price", "Region"]
+    lines = ["Quarterly Sales Report" + "," * (cols - 1), "," * (cols - 1)]
+    lines.append(",".join(f"{names[j % 5]} {j}" for j in range(cols)))
+    for r in range(rows):
+        cells = [str(r), "Widget", "2024-01-01", f"{rng.normal():.3f}", rng.choice(["North", "South"])]
+        lines.append(",".join(cells[j % 5] for j in range(cols)))
+    df = pd.read_csv(io.StringIO("\n".join(lines)), header=None, skiprows=[0], low_memory=False)
+    df.columns = [f"Unnamed: {j}" for j in range(cols)]
+    return optimize_frame(df)[0]
+
+
+def timed(func, df, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(df)
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+if __name__ == "__main__":
+    for seed in range(50):
+        df = messy_sheet(rows=30, cols=int(np.random.default_rng(seed).integers(1, 60)), seed=seed)
+        assert legacy_header_row(df) == vectorized_header_row(df), f"mismatch for seed {seed}"
+    print("Header detection matches the legacy loop on 50 generated sheets")
+
+    for label, make in (("titled upload", titled_upload), ("mixed dtypes", messy_sheet)):
+        for cols in (20, 100, 500, 2000):
+            df = make(rows=1000, cols=cols, seed=cols)
+            before, legacy_s = timed(legacy_header_row, df, repeat=5)
+            after, vector_s = timed(vectorized_header_row, df, repeat=5)
+            assert before == after
+            print(f"{label}, {cols:>4} columns: loop {legacy_s * 1000:8.2f} ms  "
+                  f"vectorized {vector_s * 1000:7.2f} ms  ({legacy_s / vector_s:5.1f}x)")
@@ -1,12 +1,27 @@
 # File: backend/run.py
+import os
+
 from flask.cli import load_dotenv
 import uvicorn
 load_dotenv()
 
+# MORPH_WORKERS > 1 runs several server processes (no auto-reload); they share
+# parsed datasets through the shared dataset store.
+WORKERS = int(os.environ.get("MORPH_WORKERS", "1"))
+
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",  # Correct path: looks in 'app' folder for 'main.py'
-        host="127.0.0.1",
-        port=8000,
-        reload=True
-    )
\ No newline at end of file
+    if WORKERS > 1:
+        os.environ.setdefault("MORPH_SHARED_DATASETS", "1")
+        uvicorn.run(
+            "app.main:app",
+            host="127.0.0.1",
+            port=8000,
+            workers=WORKERS,
+        )
+    else:
+        uvicorn.run(
+            "app.main:app",  # Correct path: looks in 'app' folder for 'main.py'
+            host="127.0.0.1",
+            port=8000,
+            reload=True
+        )
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from app.services.ingest import parse_upload, sniff_csv
+
+
+def _write(tmp_path, text: str) -> str:
+    path = tmp_path / "upload.csv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("text", [
+    "a,b,c\nx,'y',z\n",
+    "name,comment\n'Brien,it's fine\n",
+    "name,note\nO'Brien,it's fine\nD'Arcy,'quoted'\n",
+])
+def test_apostrophes_are_kept_as_text(tmp_path, text):
+    path = _write(tmp_path, text)
+    assert sniff_csv(path)["quotechar"] == '"'
+    df, _, _ = parse_upload(path, "upload.csv")
+    expected = pd.read_csv(path, dtype=str)
+    assert df.astype(str).values.tolist() == expected.values.tolist()
+
+
+def test_single_quotes_around_delimiters_are_quotes(tmp_path):
+    path = _write(tmp_path, "a,b\n'x,y',z\n'p',q\n")
+    assert sniff_csv(path)["quotechar"] == "'"
+    df, _, _ = parse_upload(path, "upload.csv")
+    assert df["a"].tolist() == ["x,y", "p"]